@@ -0,0 +1,48 @@
+"""
+Gunicorn settings, read from the directory gunicorn starts in (see Procfile).
+
+The master imports the app once (preload_app) and forks the workers from
+it, so they share the imported code and start without importing it again.
+Per-process state must not cross the fork: post_fork drops the database
+pools a worker inherits and gives it its own cache state (a fresh
+memory:// epoch, its own Redis invalidation listener). GUNICORN_PRELOAD=0
+goes back to importing per worker.
+"""
+import gc
+import os
+
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") != "0"
+
+
+def on_starting(server):
+    # The memory:// cache can't be shared by several workers (see cache_backends.py);
+    # checked in the master to warn once, the preloaded workers inherit the result
+    from cache import cache_backend
+    from cache_backends import check_workers
+
+    check_workers(cache_backend, server.cfg.workers)
+
+
+def when_ready(server):
+    # Objects the master loaded stay out of the workers' collections,
+    # which would otherwise write to the pages they share with it
+    if preload_app:
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    from cache import cache_backend
+    from cache_backends import check_workers
+
+    # Without preload_app the worker has just imported a cache of its own
+    check_workers(cache_backend, server.cfg.workers)
+    if not preload_app:
+        return
+    from wsgi import application
+    from models import db
+
+    with application.app_context():
+        for engine in db.engines.values():
+            # close=False leaves the master's connections, if any, to the master
+            engine.dispose(close=False)
+    cache_backend.after_fork()
@@ -0,0 +1,40 @@
+"""catalog search indexes (postgres)
+
+Revision ID: 9e2f6a1b7c38
+Revises: 7c41d2a9e8b5
+Create Date: 2026-10-18 11:48:05.102377
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '9e2f6a1b7c38'
+down_revision = '7c41d2a9e8b5'
+branch_labels = None
+depends_on = None
+
+# Must stay identical to search.document(), or the planner won't use them
+DOCUMENTS = {
+    'person': "coalesce(name, '')",
+    'planet': "coalesce(name, '') || ' ' || coalesce(terrain, '') || ' ' || coalesce(climate, '')",
+    'starship': "coalesce(name, '') || ' ' || coalesce(model, '') || ' ' || coalesce(manufacturer, '')",
+}
+
+
+def upgrade():
+    # Only SEARCH_BACKEND=postgres uses these, other databases search in memory
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for table, document in DOCUMENTS.items():
+        op.execute(f"CREATE INDEX ix_{table}_search ON {table} USING gin (to_tsvector('simple'::regconfig, {document}))")
+        op.execute(f"CREATE INDEX ix_{table}_name_trgm ON {table} USING gin (name gin_trgm_ops)")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    for table in DOCUMENTS:
+        op.execute(f"DROP INDEX IF EXISTS ix_{table}_name_trgm")
+        op.execute(f"DROP INDEX IF EXISTS ix_{table}_search")
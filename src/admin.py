@@ -1,16 +1,192 @@
+"""
+Flask-Admin views for every model, at /admin.
+
+The list views are built for large tables:
+
+- Pages fetch their ids first, with an index-only LIMIT/OFFSET query, then
+  load just those rows and their relationships.
+- Only indexed columns can be sorted and filtered, with the operators an
+  index can serve. Sorts end with the id, like the (column, id) indexes.
+- Unfiltered lists show the planner's row estimate (pg_class.reltuples on
+  Postgres, information_schema on MySQL) once a table passes
+  ESTIMATE_MIN_ROWS, instead of running COUNT(*).
+- Foreign keys are listed (and sorted) as columns, showing the related
+  row, which is joined into the page query (column_select_related_list).
+  Relationships the list doesn't show are not loaded. Forms pick related
+  rows with ajax lookups rather than a select of the whole table.
+"""
 import os
+import threading
 from flask_admin import Admin
-from models import db, User
-from flask_admin.contrib.sqla import ModelView
+from flask_admin.contrib.sqla import ModelView, filters
+from sqlalchemy import desc, text
+from sqlalchemy.orm import lazyload, undefer
+from models import db, User, Person, Planet, Starship, Favorite
+
+PAGE_SIZE = 50
+ESTIMATE_MIN_ROWS = 100000
+
+NUMBER_FILTERS = (filters.FloatEqualFilter, filters.FloatGreaterFilter, filters.FloatSmallerFilter)
+ID_FILTERS = (filters.IntEqualFilter, filters.IntInListFilter)
+TEXT_FILTERS = (filters.FilterEqual, filters.FilterInList)
+
+
+def estimated_count(session, model):
+    """The planner's row count of a table, or None when it has none or the table is small."""
+    connection = session.connection()
+    dialect = connection.dialect.name
+    if dialect == "postgresql":
+        sql = "SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:table)"
+        table = connection.dialect.identifier_preparer.format_table(model.__table__)
+    elif dialect in ("mysql", "mariadb"):
+        sql = "SELECT table_rows FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = :table"
+        table = model.__tablename__
+    else:
+        return None
+    # reltuples is -1 until the table is first analyzed
+    estimate = connection.execute(text(sql), {"table": table}).scalar()
+    if estimate is None or estimate < ESTIMATE_MIN_ROWS:
+        return None
+    return int(estimate)
+
+
+def indexed_filters(model, labels, columns):
+    """Filters for `columns` of `model`, each with the operators of its `labels` group."""
+    return [
+        flt(getattr(model, column), column.replace("_", " ").title())
+        for column in columns
+        for flt in labels
+    ]
+
+
+def _label(view, context, model, name):
+    # Renders a foreign key column as the related row, "<name>_id" -> "<name>"
+    item = getattr(model, name[:-len("_id")])
+    if item is None:
+        return ""
+    return f"{getattr(item, 'name', None) or getattr(item, 'username', '')} #{item.id}"
+
+
+class IndexedModelView(ModelView):
+    page_size = PAGE_SIZE
+    can_set_page_size = False
+    column_display_pk = True
+    column_default_sort = ("id", True)
+    # Deferred columns to show, and relationships the model loads eagerly that the list doesn't show
+    undeferred = ()
+    lazy = ()
+
+    def __init__(self, model, session, **kwargs):
+        super().__init__(model, session, **kwargs)
+        self._estimating = threading.local()
+
+    def get_query(self):
+        query = super().get_query()
+        options = [undefer(getattr(self.model, name)) for name in self.undeferred]
+        options += [lazyload(getattr(self.model, name)) for name in self.lazy]
+        return query.options(*options) if options else query
+
+    def get_count_query(self):
+        if getattr(self._estimating, "active", False):
+            return None
+        return super().get_count_query()
+
+    def get_list(self, page, sort_column, sort_desc, search, filters, execute=True, page_size=None):
+        estimate = None if search or filters else estimated_count(self.session, self.model)
+        if estimate is None:
+            return super().get_list(page, sort_column, sort_desc, search, filters, execute, page_size)
+        self._estimating.active = True
+        try:
+            _, rows = super().get_list(page, sort_column, sort_desc, search, filters, execute, page_size)
+        finally:
+            self._estimating.active = False
+        return estimate, rows
+
+    def _order_by(self, query, joins, sort_joins, sort_field, sort_desc):
+        query, joins = super()._order_by(query, joins, sort_joins, sort_field, sort_desc)
+        # Ties in id order, so OFFSET pages are stable and walk the (column, id) index
+        if sort_field is not None and sort_field is not self.model.id:
+            query = query.order_by(desc(self.model.id) if sort_desc else self.model.id)
+        return query, joins
+
+    def _apply_pagination(self, query, page, page_size):
+        query = super()._apply_pagination(query, page, page_size)
+        if not page:
+            return query
+        # Deferred join: the OFFSET walks the index for ids only, the rows
+        # and their eager loads are read for one page
+        ids = [row[0] for row in query.with_entities(self.model.id)]
+        return query.limit(None).offset(None).filter(self.model.id.in_(ids))
+
+
+class UserView(IndexedModelView):
+    column_list = ("id", "username", "is_active")
+    column_sortable_list = ("id", "username")
+    column_filters = indexed_filters(User, ID_FILTERS, ["id"]) + indexed_filters(User, TEXT_FILTERS, ["username"])
+    lazy = ("favorites",)
+    form_excluded_columns = ("favorites",)
+
+
+class PersonView(IndexedModelView):
+    column_list = ("id", "name", "gender", "height", "mass", "planet_id", "favorite_count")
+    column_sortable_list = ("id", "height", "mass", "planet_id", "favorite_count")
+    column_filters = (
+        indexed_filters(Person, ID_FILTERS, ["id", "planet_id"])
+        + indexed_filters(Person, NUMBER_FILTERS, ["height", "mass", "favorite_count"])
+    )
+    column_labels = {"planet_id": "Planet"}
+    column_formatters = {"planet_id": _label}
+    column_select_related_list = (Person.planet,)
+    undeferred = ("favorite_count",)
+    # Counters are kept by favorites.py and popularity.py
+    form_excluded_columns = ("favorites", "favorite_count", "planet_id")
+    form_ajax_refs = {"planet": {"fields": ("name",), "page_size": 10}}
+
+
+class PlanetView(IndexedModelView):
+    column_list = ("id", "name", "climate", "terrain", "diameter", "population", "favorite_count")
+    column_sortable_list = ("id", "diameter", "population", "favorite_count")
+    column_filters = (
+        indexed_filters(Planet, ID_FILTERS, ["id"])
+        + indexed_filters(Planet, NUMBER_FILTERS, ["diameter", "population", "favorite_count"])
+    )
+    undeferred = ("favorite_count",)
+    form_excluded_columns = ("favorites", "favorite_count", "residents")
+
+
+class StarshipView(IndexedModelView):
+    column_list = ("id", "name", "model", "starship_class", "cost_in_credits", "length", "cargo_capacity",
+                   "favorite_count")
+    column_sortable_list = ("id", "cost_in_credits", "length", "cargo_capacity", "favorite_count")
+    column_filters = (
+        indexed_filters(Starship, ID_FILTERS, ["id"])
+        + indexed_filters(Starship, NUMBER_FILTERS, ["cost_in_credits", "length", "cargo_capacity", "favorite_count"])
+    )
+    undeferred = ("favorite_count",)
+    form_excluded_columns = ("favorites", "favorite_count")
+
+
+class FavoriteView(IndexedModelView):
+    column_list = ("id", "user_id", "person_id", "planet_id", "starship_id")
+    column_sortable_list = column_list
+    column_filters = indexed_filters(Favorite, ID_FILTERS, ["id", "user_id", "person_id", "planet_id", "starship_id"])
+    column_labels = {"user_id": "User", "person_id": "Person", "planet_id": "Planet", "starship_id": "Starship"}
+    column_formatters = {name: _label for name in column_list[1:]}
+    column_select_related_list = (Favorite.user, Favorite.person, Favorite.planet, Favorite.starship)
+    form_ajax_refs = {
+        "user": {"fields": ("username",), "page_size": 10},
+        "person": {"fields": ("name",), "page_size": 10},
+        "planet": {"fields": ("name",), "page_size": 10},
+        "starship": {"fields": ("name",), "page_size": 10},
+    }
+
 
 def setup_admin(app):
     app.secret_key = os.environ.get('FLASK_APP_KEY', 'sample key')
     app.config['FLASK_ADMIN_SWATCH'] = 'cerulean'
     admin = Admin(app, name='4Geeks Admin', template_mode='bootstrap3')
-
-    
-    # Add your models here, for example this is how we add a the User model to the admin
-    admin.add_view(ModelView(User, db.session))
-
-    # You can duplicate that line to add mew models
-    # admin.add_view(ModelView(YourModelName, db.session))
\ No newline at end of file
+    admin.add_view(UserView(User, db.session))
+    admin.add_view(PersonView(Person, db.session))
+    admin.add_view(PlanetView(Planet, db.session))
+    admin.add_view(StarshipView(Starship, db.session))
+    admin.add_view(FavoriteView(Favorite, db.session))
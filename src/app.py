@@ -1,59 +1,105 @@
 """
-This module starts the API Server, loads the DB, and adds endpoints
+This module builds the API Server, loads the DB, and adds endpoints
+
+create_app() returns a new app with the API routes. The admin, migrations
+(flask db) and CORS are optional subsystems, imported only when enabled:
+scripts and benchmarks ask for none of them and skip their import cost.
 """
 import os
-from flask import Flask, request, jsonify
-from flask_migrate import Migrate
-from flask_cors import CORS
+from flask import Flask, Blueprint, request, jsonify, current_app
 from utils import APIException, generate_sitemap
-from admin import setup_admin
 from models import db, User, Person, Planet, Starship, Favorite
-
-app = Flask(__name__)
-app.url_map.strict_slashes = False
-
-# Database setup
-db_url = os.getenv("DATABASE_URL")
-if db_url is not None:
-    app.config['SQLALCHEMY_DATABASE_URI'] = db_url.replace("postgres://", "postgresql://")
-else:
-    app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:////tmp/test.db"
-
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-migrate = Migrate(app, db)
-db.init_app(app)
-CORS(app)
-setup_admin(app)
+from database import database_uri, engine_options, check_pool_budget
+from pagination import paginate
+from streaming import wants_stream, stream_export
+from cache import get_serialized, get_serialized_favorites, cached_response, cache_key
+from conditional import conditional
+from serialization import FastJSONProvider
+from identity import resolve_user_id
+from favorites import add_favorite, remove_favorite, add_favorites_bulk, remove_favorites_bulk
+from instrumentation import setup_instrumentation
+from metrics import setup_metrics
+from compression import setup_compression
+from search import search, parse_search_args
+from popularity import leaderboard, parse_leaderboard_args
+from expand import parse_expand, item_options
+
+SUBSYSTEMS = ("admin", "migrations", "cors")
+# Response headers browsers may read cross-origin (asgi.py sends the same)
+CORS_EXPOSE_HEADERS = ["Link", "X-Next-Cursor", "Server-Timing"]
+
+api = Blueprint("api", __name__)
+
+
+def create_app(subsystems=SUBSYSTEMS):
+    """Build the app with the given optional `subsystems` (see SUBSYSTEMS)."""
+    unknown = set(subsystems) - set(SUBSYSTEMS)
+    if unknown:
+        raise ValueError(f"unknown subsystems: {', '.join(sorted(unknown))}")
+
+    app = Flask(__name__)
+    app.url_map.strict_slashes = False
+    app.json = FastJSONProvider(app)
+
+    # Database setup
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_uri()
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+    check_pool_budget(app.config['SQLALCHEMY_ENGINE_OPTIONS'])
+
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    if "migrations" in subsystems:
+        from flask_migrate import Migrate
+        Migrate(app, db)
+    if "cors" in subsystems:
+        from flask_cors import CORS
+        CORS(app, expose_headers=CORS_EXPOSE_HEADERS)
+    if "admin" in subsystems:
+        from admin import setup_admin
+        setup_admin(app)
+    setup_instrumentation(app)
+    setup_metrics(app)
+    setup_compression(app)
+    app.register_blueprint(api)
+    return app
 
 # Handle/serialize errors
-@app.errorhandler(APIException)
+@api.app_errorhandler(APIException)
 def handle_invalid_usage(error):
     return jsonify(error.to_dict()), error.status_code
 
 # Sitemap
-@app.route('/')
+@api.route('/')
 def sitemap():
-    return generate_sitemap(app)
+    return generate_sitemap(current_app)
 
 # Test route
-# @app.route('/user', methods=['GET'])
+# @api.route('/user', methods=['GET'])
 # def handle_hello():
 #     return jsonify({"msg": "Hello, this is your GET /user response"}), 200
 
 # USERS
-@app.route('/user', methods=['GET'])
+@api.route('/user', methods=['GET'])
+@conditional("user", "user.favorites", "person", "planet", "starship")
 def get_all_users():
-    users = User.query.all()
-    return jsonify([user.serialize() for user in users]), 200
-
-@app.route('/user/<int:user_id>', methods=['GET'])
+    expand = parse_expand()
+    if expand is None:
+        return paginate(User, hydrate=True), 200
+    return paginate(
+        User, hydrate=True, options=item_options(expand, User.favorites), serialize=lambda user: user.serialize(expand)
+    ), 200
+
+@api.route('/user/<int:user_id>', methods=['GET'])
 def get_user(user_id):
-    user = User.query.get(user_id)
+    expand = parse_expand()
+    options = item_options(expand, User.favorites) if expand is not None else ()
+    user = db.session.get(User, user_id, options=options)
     if user is None:
         return jsonify({"error": "User not found"}), 404
-    return jsonify(user.serialize()), 200
+    return jsonify(user.serialize(expand)), 200
 
-@app.route('/user/favorites', methods=["GET"])
+@api.route('/user/favorites', methods=["GET"])
+@conditional("user", "user.favorites", "person", "planet", "starship", vary=("X-Username",))
 def get_current_user_favorites():
     # Try to get the username from a custom header
     username = request.headers.get("X-Username")
@@ -61,153 +107,106 @@ def get_current_user_favorites():
     if not username:
         return jsonify({"error": "Missing 'X-Username' header"}), 400
 
-    user = User.query.filter_by(username=username).first()
-    if not user:
+    user_id = resolve_user_id(username)
+    if user_id is None:
         return jsonify({"error": "User not found"}), 404
 
-    favorites = [fav.serialize() for fav in user.favorites]
-    return jsonify(favorites), 200
+    expand = parse_expand()
+    if expand is None:
+        body, hit = get_serialized_favorites(user_id)
+        return cached_response(body, hit), 200
+    # Compact responses are cached whole by @conditional
+    favorites = Favorite.query.options(*item_options(expand)).filter_by(user_id=user_id).order_by(Favorite.id)
+    return jsonify([fav.reference(expand) for fav in favorites]), 200
 
 # FAVORITES
-@app.route("/favorite/planet/<int:planet_id>", methods=["POST"])
-def add_favorite_planet(planet_id):
-    username = request.json.get("username")
-    user = User.query.filter_by(username=username).first()
-    planet = Planet.query.get(planet_id)
-
-    if not user or not planet:
-        return jsonify({"error": "User or planet not found"}), 404
-
-    existing = Favorite.query.filter_by(user_id=user.id, planet_id=planet_id).first()
-    if existing:
-        return jsonify({"error": "Favorite already exists"}), 400
-
-    favorite = Favorite(user_id=user.id, planet_id=planet.id)
-    db.session.add(favorite)
-    db.session.commit()
-    return jsonify(favorite.serialize()), 201
-
-@app.route("/favorite/planet/<int:planet_id>", methods=["DELETE"])
-def delete_favorite_planet(planet_id):
-    username = request.args.get("username")
-    user = User.query.filter_by(username=username).first()
-    if not user:
-        return jsonify({"error": "User not found"}), 404
-
-    favorite = Favorite.query.filter_by(user_id=user.id, planet_id=planet_id).first()
-    if not favorite:
-        return jsonify({"error": "Favorite not found"}), 404
-
-    db.session.delete(favorite)
-    db.session.commit()
-    return jsonify({"msg": "Favorite planet removed"}), 200
-
-@app.route("/favorite/people/<int:people_id>", methods=["POST"])
-def add_favorite_person(people_id):
+@api.route("/favorite/<any(planet, people, starship):kind>/<int:item_id>", methods=["POST"])
+def add_favorite_item(kind, item_id):
     username = request.json.get("username")
-    user = User.query.filter_by(username=username).first()
-    person = Person.query.get(people_id)
+    return add_favorite(kind, item_id, username)
 
-    if not user or not person:
-        return jsonify({"error": "User or person not found"}), 404
-
-    existing = Favorite.query.filter_by(user_id=user.id, person_id=people_id).first()
-    if existing:
-        return jsonify({"error": "Favorite already exists"}), 400
-
-    favorite = Favorite(user_id=user.id, person_id=person.id)
-    db.session.add(favorite)
-    db.session.commit()
-    return jsonify(favorite.serialize()), 201
-
-@app.route("/favorite/people/<int:people_id>", methods=["DELETE"])
-def delete_favorite_person(people_id):
+@api.route("/favorite/<any(planet, people, starship):kind>/<int:item_id>", methods=["DELETE"])
+def delete_favorite_item(kind, item_id):
     username = request.args.get("username")
-    user = User.query.filter_by(username=username).first()
-    if not user:
-        return jsonify({"error": "User not found"}), 404
-
-    favorite = Favorite.query.filter_by(user_id=user.id, person_id=people_id).first()
-    if not favorite:
-        return jsonify({"error": "Favorite not found"}), 404
-
-    db.session.delete(favorite)
-    db.session.commit()
-    return jsonify({"msg": "Favorite person removed"}), 200
-
-@app.route("/favorite/starship/<int:starship_id>", methods=["POST"])
-def add_favorite_starship(starship_id):
-    username = request.json.get("username")
-    user = User.query.filter_by(username=username).first()
-    starship = Starship.query.get(starship_id)
+    return remove_favorite(kind, item_id, username)
 
-    if not user or not starship:
-        return jsonify({"error": "User or starship not found"}), 404
+@api.route("/favorites/bulk", methods=["POST"])
+def add_favorites_in_bulk():
+    return add_favorites_bulk(request.get_json(silent=True))
 
-    existing = Favorite.query.filter_by(user_id=user.id, starship_id=starship_id).first()
-    if existing:
-        return jsonify({"error": "Favorite already exists"}), 400
-
-    favorite = Favorite(user_id=user.id, starship_id=starship.id)
-    db.session.add(favorite)
-    db.session.commit()
-    return jsonify(favorite.serialize()), 201
-
-@app.route("/favorite/starship/<int:starship_id>", methods=["DELETE"])
-def delete_favorite_starship(starship_id):
-    username = request.args.get("username")
-    user = User.query.filter_by(username=username).first()
-    if not user:
-        return jsonify({"error": "User not found"}), 404
-
-    favorite = Favorite.query.filter_by(user_id=user.id, starship_id=starship_id).first()
-    if not favorite:
-        return jsonify({"error": "Favorite not found"}), 404
-
-    db.session.delete(favorite)
-    db.session.commit()
-    return jsonify({"msg": "Favorite starship removed"}), 200
+@api.route("/favorites/bulk", methods=["DELETE"])
+def delete_favorites_in_bulk():
+    return remove_favorites_bulk(request.get_json(silent=True))
 
 # PEOPLE
-@app.route("/people", methods=["GET"])
+@api.route("/people", methods=["GET"])
+@conditional("person")
 def get_all_people():
-    people = Person.query.all()
-    return jsonify([p.serialize() for p in people]), 200
+    if wants_stream():
+        return stream_export(Person), 200
+    return paginate(Person), 200
 
-@app.route("/people/<int:people_id>", methods=["GET"])
+@api.route("/people/<int:people_id>", methods=["GET"])
 def get_single_person(people_id):
-    person = Person.query.get(people_id)
-    if not person:
+    body, hit = get_serialized(Person, people_id)
+    if body is None:
         return jsonify({"error": "Person not found"}), 404
-    return jsonify(person.serialize()), 200
+    return cached_response(body, hit, cache_key(Person, people_id)), 200
 
 # PLANETS
-@app.route("/planets", methods=["GET"])
+@api.route("/planets", methods=["GET"])
+@conditional("planet")
 def get_all_planets():
-    planets = Planet.query.all()
-    return jsonify([planet.serialize() for planet in planets]), 200
+    if wants_stream():
+        return stream_export(Planet), 200
+    return paginate(Planet), 200
 
-@app.route("/planets/<int:planet_id>", methods=["GET"])
+@api.route("/planets/<int:planet_id>", methods=["GET"])
 def get_single_planet(planet_id):
-    planet = Planet.query.get(planet_id)
-    if not planet:
+    body, hit = get_serialized(Planet, planet_id)
+    if body is None:
+        return jsonify({"error": "Planet not found"}), 404
+    return cached_response(body, hit, cache_key(Planet, planet_id)), 200
+
+@api.route("/planets/<int:planet_id>/residents", methods=["GET"])
+@conditional("person", "planet")
+def get_planet_residents(planet_id):
+    # The planet usually comes from the cache, the residents from ix_person_planet_id
+    body, _ = get_serialized(Planet, planet_id)
+    if body is None:
         return jsonify({"error": "Planet not found"}), 404
-    return jsonify(planet.serialize()), 200
+    return paginate(Person, where=Person.planet_id == planet_id), 200
 
 # STARSHIPS
-@app.route("/starships", methods=["GET"])
+@api.route("/starships", methods=["GET"])
+@conditional("starship")
 def get_all_starships():
-    starships = Starship.query.all()
-    return jsonify([s.serialize() for s in starships]), 200
+    if wants_stream():
+        return stream_export(Starship), 200
+    return paginate(Starship), 200
 
-@app.route("/starships/<int:starship_id>", methods=["GET"])
+@api.route("/starships/<int:starship_id>", methods=["GET"])
 def get_single_starship(starship_id):
-    starship = Starship.query.get(starship_id)
-    if not starship:
+    body, hit = get_serialized(Starship, starship_id)
+    if body is None:
         return jsonify({"error": "Starship not found"}), 404
-    return jsonify(starship.serialize()), 200
+    return cached_response(body, hit, cache_key(Starship, starship_id)), 200
+
+# SEARCH
+@api.route("/search", methods=["GET"])
+@conditional("person", "planet", "starship")
+def search_catalog():
+    query, limit = parse_search_args()
+    return jsonify({"query": query, "results": search(query, limit)}), 200
+
+# LEADERBOARD
+@api.route("/leaderboard", methods=["GET"])
+@conditional("favorite", "favorite_count", "person", "planet", "starship")
+def get_leaderboard():
+    kind, top = parse_leaderboard_args()
+    return jsonify({"kind": kind, "results": leaderboard(kind, top)}), 200
 
 # Main entry point
 if __name__ == '__main__':
     PORT = int(os.environ.get('PORT', 3000))
-    app.run(host='0.0.0.0', port=PORT, debug=False)
+    create_app().run(host='0.0.0.0', port=PORT, debug=False)
@@ -0,0 +1,434 @@
+"""
+Optional ASGI entry point backed by SQLAlchemy's async engine.
+
+    uvicorn asgi:application --app-dir src --workers 4
+
+The catalog reads, /user/favorites and the single favorite writes are
+served natively with async DB drivers (asyncpg for Postgres, aiosqlite for
+SQLite, aiomysql for MySQL), so a worker keeps serving other requests
+while it waits on the database. Every other route is handed to the Flask
+app through asgiref's WSGI adapter. Both share the cache backend, identity
+cache and change notifications. The native routes send the same ETags,
+CORS headers and Server-Timing phases (see instrumentation.py) and count
+in the same /metrics series, under the route of the Flask view.
+Cache backend calls run in a thread (asyncio.to_thread) so a Redis round
+trip doesn't hold up the event loop; the notifications of a commit still
+reach Redis from the loop.
+"""
+import asyncio
+import json
+import os
+import re
+import time
+from email.utils import format_datetime
+from urllib.parse import parse_qs, urlencode
+from sqlalchemy import delete, exists, literal, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from app import create_app, CORS_EXPOSE_HEADERS
+from models import Person, Planet, Starship, Favorite, User
+from database import database_uri, engine_options
+from serialization import serializer_for, dumps_bytes
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from cache import cache_backend, cache_key, favorites_key
+from cache_backends import check_workers
+from conditional import validators_for
+from identity import cached_user_id, remember_user_id
+from favorites import KINDS, _insert_ignoring_duplicates, count_update
+from compression import MIN_BYTES, negotiate, compress
+from instrumentation import measure_request, finish_request, timing
+from metrics import registry, flush_due, flush
+import model_events
+
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+    "mysql": "mysql+aiomysql",
+}
+
+
+def async_database_uri(uri):
+    scheme, rest = uri.split("://", 1)
+    return f"{ASYNC_DRIVERS.get(scheme.split('+')[0], scheme)}://{rest}"
+
+
+def async_engine_options(uri):
+    options = engine_options(uri)
+    # The async engine needs its own adapted queue pool
+    options.pop("poolclass", None)
+    connect_args = options.get("connect_args", {})
+    if "options" in connect_args:
+        # asyncpg takes server settings instead of libpq options
+        timeout = connect_args.pop("options").split("=", 1)[1]
+        connect_args["server_settings"] = {"statement_timeout": timeout}
+    return options
+
+
+# uvicorn takes its default --workers from WEB_CONCURRENCY too
+check_workers(cache_backend, int(os.environ.get("WEB_CONCURRENCY") or 1))
+
+_uri = database_uri()
+engine = create_async_engine(async_database_uri(_uri), **async_engine_options(_uri))
+Session = async_sessionmaker(engine, expire_on_commit=False)
+
+FAVORITES_TABLES = ("user", "user.favorites", "person", "planet", "starship")
+
+CATALOG = {"people": (Person, "Person"), "planets": (Planet, "Planet"), "starships": (Starship, "Starship")}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, body):
+        self.status = status
+        self.body = body
+
+
+class Request:
+    def __init__(self, scope, body):
+        self.method = scope["method"]
+        self.path = scope["path"].rstrip("/") or "/"
+        self.full_path = f"{scope['path']}?{scope['query_string'].decode()}"
+        self.query = {k: v[0] for k, v in parse_qs(scope["query_string"].decode()).items()}
+        self.headers = {k.decode().lower(): v.decode() for k, v in scope["headers"]}
+        self.body = body
+
+    def json(self):
+        try:
+            return json.loads(self.body or b"null")
+        except ValueError:
+            raise HTTPError(400, {"message": "Invalid JSON body"})
+
+
+def _json(data):
+    with timing("encode"):
+        return dumps_bytes(data) + b"\n"
+
+
+async def _validator_headers(request, tables, vary=()):
+    if not cache_backend.enabled:
+        return {"Vary": ", ".join(("Accept",) + tuple(vary))}
+    # Same ETag the Flask view would hand out, so either server can answer the revalidation
+    etag, modified = await asyncio.to_thread(
+        validators_for, request.full_path, tables, {h: request.headers.get(h.lower(), "") for h in vary}
+    )
+    headers = {"ETag": f'"{etag}"', "Last-Modified": format_datetime(modified, usegmt=True)}
+    headers["Vary"] = ", ".join(("Accept",) + tuple(vary))
+    return headers
+
+
+def _int_arg(request, name, default):
+    value = request.query.get(name)
+    if value in (None, ""):
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise HTTPError(400, {"message": f"'{name}' must be an integer"})
+
+
+# CATALOG
+async def list_catalog(request, collection):
+    model, _ = CATALOG[collection]
+    limit = _int_arg(request, "limit", DEFAULT_PAGE_SIZE)
+    after = _int_arg(request, "after", None)
+    if limit < 1 or limit > MAX_PAGE_SIZE:
+        raise HTTPError(400, {"message": f"'limit' must be between 1 and {MAX_PAGE_SIZE}"})
+
+    fields = None
+    if request.query.get("fields"):
+        columns = serializer_for(model).keys
+        fields = ["id"]
+        for name in (n.strip() for n in request.query["fields"].split(",")):
+            if name and name not in fields:
+                if name not in columns:
+                    raise HTTPError(400, {"message": f"Unknown field '{name}'"})
+                fields.append(name)
+
+    headers = await _validator_headers(request, [model.__tablename__])
+    serializer = serializer_for(model, fields)
+    stmt = serializer.select().order_by(model.id).limit(limit + 1)
+    if after is not None:
+        stmt = stmt.where(model.id > after)
+    async with engine.connect() as connection:
+        rows = (await connection.execute(stmt)).all()
+
+    with timing("serialize"):
+        items = [serializer.from_row(row) for row in rows[:limit]]
+    if len(rows) > limit:
+        cursor = items[-1]["id"]
+        query = {**request.query, "after": cursor, "limit": limit}
+        headers["X-Next-Cursor"] = str(cursor)
+        headers["Link"] = f'<{request.path}?{urlencode(query)}>; rel="next"'
+    return 200, _json(items), headers
+
+
+async def get_catalog_item(request, collection, item_id):
+    model, label = CATALOG[collection]
+    key = cache_key(model, item_id)
+    body = await asyncio.to_thread(cache_backend.get, key)
+    if body is not None:
+        return 200, body, {"X-Cache": "HIT"}
+
+    serializer = serializer_for(model)
+    async with engine.connect() as connection:
+        row = (await connection.execute(serializer.select().where(model.id == item_id))).first()
+    if row is None:
+        raise HTTPError(404, {"error": f"{label} not found"})
+    with timing("serialize"):
+        item = serializer.from_row(row)
+    body = _json(item)
+    await asyncio.to_thread(cache_backend.set, key, body)
+    return 200, body, {"X-Cache": "MISS"}
+
+
+# FAVORITES
+async def resolve_user_id(connection, username):
+    if not username:
+        return None
+    user_id = await asyncio.to_thread(cached_user_id, username)
+    if user_id is None:
+        user_id = (await connection.execute(select(User.id).where(User.username == username))).scalar()
+        if user_id is not None:
+            await asyncio.to_thread(remember_user_id, username, user_id)
+    return user_id
+
+
+async def load_favorites(connection, user_id):
+    rows = (await connection.execute(
+        select(Favorite.id, Favorite.user_id, Favorite.person_id, Favorite.planet_id, Favorite.starship_id)
+        .where(Favorite.user_id == user_id).order_by(Favorite.id)
+    )).all()
+    # One IN query per kind, like the selectin loading of Favorite.serialize()
+    items = {}
+    for kind in KINDS.values():
+        ids = {getattr(row, kind.column.key) for row in rows} - {None}
+        if ids:
+            serializer = serializer_for(kind.model)
+            result = await connection.execute(serializer.select().where(kind.model.id.in_(ids)))
+            items[kind.label] = {row.id: serializer.from_row(row) for row in result}
+
+    favorites = []
+    for row in rows:
+        data = {"id": row.id, "user_id": row.user_id}
+        for kind in KINDS.values():
+            item_id = getattr(row, kind.column.key)
+            data[kind.label] = items[kind.label][item_id] if item_id is not None else None
+        favorites.append(data)
+    return favorites
+
+
+async def get_current_user_favorites(request):
+    username = request.headers.get("x-username")
+    if not username:
+        raise HTTPError(400, {"error": "Missing 'X-Username' header"})
+
+    headers = await _validator_headers(request, FAVORITES_TABLES, vary=("X-Username",))
+    async with engine.connect() as connection:
+        user_id = await resolve_user_id(connection, username)
+        if user_id is None:
+            raise HTTPError(404, {"error": "User not found"})
+        body = await asyncio.to_thread(cache_backend.get, favorites_key(user_id))
+        if body is not None:
+            return 200, body, {**headers, "X-Cache": "HIT"}
+        body = _json(await load_favorites(connection, user_id))
+    await asyncio.to_thread(cache_backend.set, favorites_key(user_id), body)
+    return 200, body, {**headers, "X-Cache": "MISS"}
+
+
+async def add_favorite(request, kind_name, item_id):
+    kind = KINDS[kind_name]
+    payload = request.json()
+    username = payload.get("username") if isinstance(payload, dict) else None
+    if username is not None and not isinstance(username, str):
+        raise HTTPError(400, {"message": "'username' must be a string"})
+
+    async with Session() as session:
+        connection = await session.connection()
+        user_id = await resolve_user_id(connection, username)
+        if user_id is None:
+            raise HTTPError(404, {"error": f"User or {kind.label} not found"})
+
+        source = select(literal(user_id), kind.model.id).where(kind.model.id == item_id)
+        stmt = _insert_ignoring_duplicates(connection.dialect).from_select(["user_id", kind.column.key], source)
+        if connection.dialect.insert_returning:
+            favorite_id = (await connection.execute(stmt.returning(Favorite.id))).scalar()
+        else:
+            inserted = (await connection.execute(stmt)).rowcount
+            favorite_id = (await connection.execute(
+                select(Favorite.id).where(Favorite.user_id == user_id, kind.column == item_id)
+            )).scalar() if inserted else None
+
+        if favorite_id is None:
+            await session.rollback()
+            found = (await session.execute(select(exists().where(kind.model.id == item_id)))).scalar()
+            if not found:
+                raise HTTPError(404, {"error": f"User or {kind.label} not found"})
+            raise HTTPError(400, {"error": "Favorite already exists"})
+
+        await connection.execute(count_update(kind, [item_id], 1))
+        serializer = serializer_for(kind.model)
+        item = (await connection.execute(serializer.select().where(kind.model.id == item_id))).first()
+        model_events.mark_changed(session.sync_session, "favorite", favorite_id)
+        model_events.mark_changed(session.sync_session, "user.favorites", user_id)
+        await session.commit()
+
+    data = {"id": favorite_id, "user_id": user_id, "person": None, "planet": None, "starship": None}
+    data[kind.label] = serializer.from_row(item)
+    return 201, _json(data), {}
+
+
+async def remove_favorite(request, kind_name, item_id):
+    kind = KINDS[kind_name]
+    async with Session() as session:
+        connection = await session.connection()
+        user_id = await resolve_user_id(connection, request.query.get("username"))
+        if user_id is None:
+            raise HTTPError(404, {"error": "User not found"})
+
+        condition = (Favorite.user_id == user_id) & (kind.column == item_id)
+        if connection.dialect.delete_returning:
+            favorite_id = (await connection.execute(delete(Favorite).where(condition).returning(Favorite.id))).scalar()
+        else:
+            favorite_id = (await connection.execute(select(Favorite.id).where(condition))).scalar()
+            if favorite_id is not None:
+                await connection.execute(delete(Favorite).where(Favorite.id == favorite_id))
+        if favorite_id is None:
+            raise HTTPError(404, {"error": "Favorite not found"})
+
+        await connection.execute(count_update(kind, [item_id], -1))
+        model_events.mark_changed(session.sync_session, "favorite", favorite_id)
+        model_events.mark_changed(session.sync_session, "user.favorites", user_id)
+        await session.commit()
+    return 200, _json({"msg": f"Favorite {kind.label} removed"}), {}
+
+
+# The Flask rule of each route labels its metrics, by collection where it has one
+ITEM_RULES = {
+    "people": "/people/<int:people_id>",
+    "planets": "/planets/<int:planet_id>",
+    "starships": "/starships/<int:starship_id>",
+}
+FAVORITE_RULE = "/favorite/<any(planet, people, starship):kind>/<int:item_id>"
+
+ROUTES = [
+    ("GET", re.compile(r"/(people|planets|starships)"), list_catalog, {name: f"/{name}" for name in CATALOG}),
+    ("GET", re.compile(r"/(people|planets|starships)/(\d+)"), get_catalog_item, ITEM_RULES),
+    ("GET", re.compile(r"/user/favorites"), get_current_user_favorites, "/user/favorites"),
+    ("POST", re.compile(r"/favorite/(planet|people|starship)/(\d+)"), add_favorite, FAVORITE_RULE),
+    ("DELETE", re.compile(r"/favorite/(planet|people|starship)/(\d+)"), remove_favorite, FAVORITE_RULE),
+]
+
+
+def _match(scope):
+    """Return (handler, args, Flask rule) of a native route, or Nones."""
+    path = scope["path"].rstrip("/") or "/"
+    for method, pattern, handler, rule in ROUTES:
+        match = pattern.fullmatch(path)
+        if match and scope["method"] == method:
+            args = [int(arg) if arg.isdigit() else arg for arg in match.groups()]
+            return handler, args, rule[args[0]] if isinstance(rule, dict) else rule
+    return None, None, None
+
+
+def _conditional_or_streaming(scope):
+    # ETags, exports, filters, compact favorites and content negotiation live in the Flask views
+    headers = {k.decode().lower() for k, _ in scope["headers"]}
+    query = scope["query_string"].decode()
+    return bool(headers & {"if-none-match", "if-modified-since"}) or any(
+        arg in query for arg in ("stream=", "filter=", "sort=", "compact=", "expand=")
+    ) or any(
+        k.decode().lower() == "accept" and b"ndjson" in v for k, v in scope["headers"]
+    )
+
+
+async def _read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+def _compressed(request, status, body, headers):
+    # Same rules as compression.setup_compression() for the Flask views
+    if status != 200 or not MIN_BYTES or len(body) < MIN_BYTES:
+        return body
+    headers["Vary"] = ", ".join(filter(None, [headers.get("Vary"), "Accept-Encoding"]))
+    encoding = negotiate(request.headers.get("accept-encoding", ""))
+    if encoding is None:
+        return body
+    headers["Content-Encoding"] = encoding
+    if headers.get("ETag", "").startswith('"'):
+        headers["ETag"] = f"W/{headers['ETag']}"
+    return compress(body, encoding)
+
+
+def _cors(request, headers):
+    # What flask_cors adds with the options of create_app(): any origin, echoed when given
+    origin = request.headers.get("origin")
+    headers["Access-Control-Allow-Origin"] = origin or "*"
+    headers["Access-Control-Expose-Headers"] = ", ".join(sorted(CORS_EXPOSE_HEADERS))
+    if origin:
+        headers["Vary"] = ", ".join(filter(None, [headers.get("Vary"), "Origin"]))
+
+
+def _flush_metrics():
+    with _fallback().wsgi_application.app_context():
+        flush()
+
+
+async def _send(send, status, body, headers):
+    raw_headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+    raw_headers += [(k.lower().encode(), v.encode()) for k, v in headers.items()]
+    await send({"type": "http.response.start", "status": status, "headers": raw_headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await engine.dispose()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+_wsgi_fallback = None
+
+
+def _fallback():
+    global _wsgi_fallback
+    if _wsgi_fallback is None:
+        from asgiref.wsgi import WsgiToAsgi
+        # Built on the first request it serves, not at startup
+        _wsgi_fallback = WsgiToAsgi(create_app(subsystems=("admin", "cors")))
+    return _wsgi_fallback
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await _lifespan(receive, send)
+
+    handler, args, rule = _match(scope) if scope["type"] == "http" else (None, None, None)
+    if handler is None or _conditional_or_streaming(scope):
+        return await _fallback()(scope, receive, send)
+
+    request = Request(scope, await _read_body(receive))
+    with measure_request() as metrics:
+        try:
+            status, body, headers = await handler(request, *args)
+        except HTTPError as error:
+            status, body, headers = error.status, _json(error.body), {}
+        except Exception:
+            registry.observe(rule, request.method, 500, time.perf_counter() - metrics.start)
+            raise
+        body = _compressed(request, status, body, headers)
+    _cors(request, headers)
+    server_timing = finish_request(metrics, request.method, request.path, f"asgi.{handler.__name__}", status)
+    if server_timing:
+        headers["Server-Timing"] = server_timing
+    registry.observe(rule, request.method, status, time.perf_counter() - metrics.start)
+    if flush_due():
+        await asyncio.to_thread(_flush_metrics)
+    await _send(send, status, body, headers)
@@ -0,0 +1,401 @@
+"""
+Micro benchmarks for the API internals. Runs against a throwaway in-memory
+DB unless --database-url is given:
+
+    python src/benchmarks.py serialization --rows 20000
+    python src/benchmarks.py favorites --requests 500
+    python src/benchmarks.py --database-url sqlite:////tmp/bench.db load --concurrency 256
+    python src/benchmarks.py --database-url sqlite:////tmp/bench.db routes --scale large
+    python src/benchmarks.py compare bench-results/<old>.json bench-results/<new>.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+
+def in_memory(database_url):
+    return database_url in ("sqlite://", "sqlite:///:memory:")
+
+
+def timed(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_serialization(args):
+    from sqlalchemy import insert, select
+    from app import create_app
+    app = create_app(subsystems=())
+    from models import db, Person, Planet, Starship
+    from serialization import serializer_for, dumps_bytes, orjson
+    from synthetic import make_person, make_planet, make_starship
+
+    factories = {Planet: make_planet, Person: make_person, Starship: make_starship}
+    results = {"rows": args.rows, "encoder": "orjson" if orjson else "json", "models": {}}
+
+    with app.app_context():
+        db.create_all()
+        for model, factory in factories.items():
+            db.session.execute(insert(model), [factory(i) for i in range(args.rows)])
+        db.session.commit()
+
+        for model in factories:
+            serializer = serializer_for(model)
+
+            def before():
+                # ORM instances + serialize() + stdlib encoder (what jsonify used to do)
+                objects = db.session.execute(select(model)).scalars().all()
+                json.dumps([obj.serialize() for obj in objects], sort_keys=True, separators=(",", ":"))
+                db.session.expunge_all()
+
+            def after():
+                # Plain Row tuples + compiled column list + fast encoder
+                rows = db.session.execute(serializer.select()).all()
+                dumps_bytes([serializer.from_row(row) for row in rows])
+
+            before_time = timed(before, args.repeat)
+            after_time = timed(after, args.repeat)
+            results["models"][model.__tablename__] = {
+                "before_rows_per_sec": round(args.rows / before_time),
+                "after_rows_per_sec": round(args.rows / after_time),
+                "speedup": round(before_time / after_time, 2),
+            }
+    return results
+
+
+def legacy_favorite_routes(app):
+    """Register the per-kind handlers favorites.py replaced under /legacy, to measure them."""
+    from flask import jsonify, request
+    from models import db, User, Person, Planet, Starship, Favorite
+
+    columns = {"planet": (Planet, "planet_id"), "people": (Person, "person_id"), "starship": (Starship, "starship_id")}
+
+    # User lookup, item get, existence check, then the write
+    def add(kind, item_id):
+        model, column = columns[kind]
+        user = User.query.filter_by(username=request.json.get("username")).first()
+        item = db.session.get(model, item_id)
+        if not user or not item:
+            return jsonify({"error": "User or item not found"}), 404
+        if Favorite.query.filter_by(user_id=user.id, **{column: item_id}).first():
+            return jsonify({"error": "Favorite already exists"}), 400
+        favorite = Favorite(user_id=user.id, **{column: item.id})
+        db.session.add(favorite)
+        db.session.commit()
+        return jsonify(favorite.serialize()), 201
+
+    def remove(kind, item_id):
+        _, column = columns[kind]
+        user = User.query.filter_by(username=request.args.get("username")).first()
+        if not user:
+            return jsonify({"error": "User not found"}), 404
+        favorite = Favorite.query.filter_by(user_id=user.id, **{column: item_id}).first()
+        if not favorite:
+            return jsonify({"error": "Favorite not found"}), 404
+        db.session.delete(favorite)
+        db.session.commit()
+        return jsonify({"msg": "Favorite removed"}), 200
+
+    app.add_url_rule("/legacy/favorite/<kind>/<int:item_id>", "legacy_add", add, methods=["POST"])
+    app.add_url_rule("/legacy/favorite/<kind>/<int:item_id>", "legacy_remove", remove, methods=["DELETE"])
+
+
+def bench_favorites(args):
+    from app import create_app
+    app = create_app(subsystems=())
+    legacy_favorite_routes(app)
+    from models import db
+    from instrumentation import count_queries
+    from synthetic import populate
+
+    with app.app_context():
+        db.create_all()
+        populate(people=args.rows, planets=args.rows, starships=args.rows, users=args.requests, favorites_per_user=0)
+
+    client = app.test_client()
+    scenarios = {
+        "add": lambda prefix, i, kind: client.post(
+            f"{prefix}/favorite/{kind}/{i % args.rows + 1}", json={"username": f"user_{i}"}),
+        "add duplicate": lambda prefix, i, kind: client.post(
+            f"{prefix}/favorite/{kind}/{i % args.rows + 1}", json={"username": f"user_{i}"}),
+        "remove": lambda prefix, i, kind: client.delete(f"{prefix}/favorite/{kind}/{i % args.rows + 1}?username=user_{i}"),
+        "remove missing": lambda prefix, i, kind: client.delete(
+            f"{prefix}/favorite/{kind}/{i % args.rows + 1}?username=user_{i}"),
+    }
+
+    def measure(prefix, request):
+        statements = 0
+        start = time.perf_counter()
+        for i in range(args.requests):
+            kind = ("planet", "people", "starship")[i % 3]
+            with count_queries() as counter:
+                request(prefix, i, kind)
+            statements += counter.count
+        return round(statements / args.requests, 2), round(args.requests / (time.perf_counter() - start))
+
+    # Each pass ends with the favorites it added removed, so both start from the same rows
+    before = {name: measure("/legacy", request) for name, request in scenarios.items()}
+    after = {name: measure("", request) for name, request in scenarios.items()}
+    results = {"requests": args.requests, "scenarios": {}}
+    for name in scenarios:
+        results["scenarios"][name] = {
+            "queries_per_request_before": before[name][0], "queries_per_request_after": after[name][0],
+            "requests_per_sec_before": before[name][1], "requests_per_sec_after": after[name][1],
+        }
+    return results
+
+
+# Servers compared by the load test; {port} and {workers} are filled in
+SERVERS = {
+    "gunicorn": "gunicorn wsgi:application --chdir src --bind 127.0.0.1:{port} --workers {workers} --threads 4 --log-level warning",
+    "uvicorn": "uvicorn asgi:application --app-dir src --port {port} --workers {workers} --log-level warning",
+}
+
+# See cache_backends.check_workers()
+WORKERS_HELP = "server processes; more than one turns a memory:// cache off, use CACHE_URL=redis://..."
+
+LOAD_PATHS = ["/people?limit=20", "/planets/{n}", "/starships?limit=50&after={n}", "/user/favorites"]
+
+
+async def _keep_alive_client(port, paths, deadline, latencies, errors, index):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    n = index
+    try:
+        while time.perf_counter() < deadline:
+            path = paths[n % len(paths)].format(n=n % 50 + 1)
+            n += 1
+            request = f"GET {path} HTTP/1.1\r\nHost: localhost\r\nX-Username: user_{index % 100}\r\n\r\n"
+            start = time.perf_counter()
+            writer.write(request.encode())
+            status = (await reader.readline()).split()[1]
+            length = 0
+            while (line := await reader.readline()) not in (b"\r\n", b""):
+                name, _, value = line.partition(b":")
+                if name.strip().lower() == b"content-length":
+                    length = int(value)
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter() - start)
+            errors += status != b"200"
+    finally:
+        writer.close()
+    return errors
+
+
+def _percentile(values, pct):
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+async def _drive(port, paths, concurrency, duration):
+    latencies = []
+    deadline = time.perf_counter() + duration
+    start = time.perf_counter()
+    errors = await asyncio.gather(*(
+        _keep_alive_client(port, paths, deadline, latencies, 0, i) for i in range(concurrency)
+    ), return_exceptions=True)
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": sum(e if isinstance(e, int) else 1 for e in errors),
+        "requests_per_sec": round(len(latencies) / elapsed),
+        "p50_ms": round(_percentile(latencies, 50) * 1000, 2) if latencies else None,
+        "p99_ms": round(_percentile(latencies, 99) * 1000, 2) if latencies else None,
+    }
+
+
+def bench_load(args):
+    from app import create_app
+    app = create_app(subsystems=())
+    from models import db
+    from synthetic import populate
+    from route_benchmarks import wait_for_port
+
+    if in_memory(args.database_url):
+        sys.exit("the load test needs a database shared by the server processes, e.g. sqlite:////tmp/bench.db")
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        populate(people=args.rows, planets=args.rows, starships=args.rows, users=100, favorites_per_user=9)
+        db.engine.dispose()
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    results = {"concurrency": args.concurrency, "duration": args.duration, "workers": args.workers, "servers": {}}
+    for name in args.servers:
+        command = SERVERS[name].format(port=args.port, workers=args.workers).split()
+        process = subprocess.Popen(command, cwd=root, env=os.environ.copy())
+        try:
+            wait_for_port(args.port, process)
+            asyncio.run(_drive(args.port, LOAD_PATHS, min(args.concurrency, 16), 1))  # warm up
+            results["servers"][name] = asyncio.run(_drive(args.port, LOAD_PATHS, args.concurrency, args.duration))
+        finally:
+            process.terminate()
+            process.wait()
+    return results
+
+
+def print_load(results):
+    print(f"{results['concurrency']} keep-alive connections for {results['duration']}s, {results['workers']} workers")
+    print(f"{'server':<10} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for name, row in results["servers"].items():
+        print(f"{name:<10} {row['requests_per_sec']:>8} {row['p50_ms']:>8} {row['p99_ms']:>8} {row['errors']:>7}")
+
+
+def bench_routes(args):
+    from app import create_app
+    app = create_app(subsystems=())
+    from models import db
+    from synthetic import SCALES, populate
+    import route_benchmarks
+
+    scale = SCALES[args.scale]
+    dataset = {
+        "items": min(scale["people"], scale["planets"], scale["starships"]),
+        "users": scale["users"], "spare_users": args.requests,
+    }
+    targets = args.targets
+    if "gunicorn" in targets and in_memory(args.database_url):
+        sys.exit("gunicorn needs a database shared with this process, e.g. sqlite:////tmp/bench.db")
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        start = time.perf_counter()
+        populate(**scale, spare_users=dataset["spare_users"])
+        seconds = time.perf_counter() - start
+        if not in_memory(args.database_url):
+            # Fresh connections for the servers; an in-memory database lives in its only one
+            db.engine.dispose()
+    print(f"seeded {args.scale} dataset in {seconds:.1f}s", file=sys.stderr)
+
+    results = {"meta": route_benchmarks.run_metadata(args.database_url, args.scale, dataset), "targets": {}}
+    if "test-client" in targets:
+        with app.app_context():
+            results["targets"]["test-client"] = route_benchmarks.run_test_client(app, dataset, args.requests)
+    if "gunicorn" in targets:
+        results["targets"]["gunicorn"] = route_benchmarks.run_gunicorn(
+            dataset, args.requests, args.concurrency, args.workers, args.port
+        )
+    if args.output:
+        print(f"results saved to {route_benchmarks.save_results(results, args.output)}", file=sys.stderr)
+    return results
+
+
+def print_routes(results):
+    meta = results["meta"]
+    print(f"commit {meta['commit']}{' (dirty)' if meta['dirty'] else ''}, {meta['scale']} dataset on {meta['database']}")
+    for target, scenarios in results["targets"].items():
+        print(f"\n{target}")
+        print(f"{'route':<32} {'req/s':>8} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'queries':>8} {'rss MB':>8}")
+        for name, row in scenarios.items():
+            queries = "-" if row["queries_per_request"] is None else row["queries_per_request"]
+            print(f"{name:<32} {row['requests_per_sec']:>8} {row['p50_ms']:>8} {row['p90_ms']:>8} "
+                  f"{row['p99_ms']:>8} {queries:>8} {row['peak_rss_mb']:>8}")
+
+
+def bench_compare(args):
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    rows = {}
+    for target, scenarios in new["targets"].items():
+        for name, row in scenarios.items():
+            before = old["targets"].get(target, {}).get(name)
+            if before is None:
+                continue
+            rows[f"{target} {name}"] = {
+                metric: {"old": before[metric], "new": row[metric]}
+                for metric in ("requests_per_sec", "p50_ms", "p99_ms", "queries_per_request", "peak_rss_mb")
+            }
+    return {"old": old["meta"]["commit"], "new": new["meta"]["commit"], "routes": rows}
+
+
+def print_compare(results):
+    def change(values):
+        if not values["old"] or values["new"] is None:
+            return "-"
+        return f"{(values['new'] - values['old']) / values['old'] * 100:+.0f}%"
+
+    print(f"{results['old']} -> {results['new']}")
+    print(f"{'route':<44} {'req/s':>8} {'p50':>8} {'p99':>8} {'queries':>8} {'rss':>8}")
+    for name, row in results["routes"].items():
+        print(f"{name:<44} " + " ".join(f"{change(values):>8}" for values in row.values()))
+
+
+def print_favorites(results):
+    print(f"{results['requests']} requests per scenario (query counts exclude COMMIT)")
+    print(f"{'scenario':<16} {'queries before':>14} {'queries after':>14} {'req/s before':>13} {'req/s after':>12}")
+    for name, row in results["scenarios"].items():
+        print(f"{name:<16} {row['queries_per_request_before']:>14} {row['queries_per_request_after']:>14} "
+              f"{row['requests_per_sec_before']:>13} {row['requests_per_sec_after']:>12}")
+
+
+def print_serialization(results):
+    print(f"{results['rows']} rows per model, encoder: {results['encoder']}")
+    print(f"{'model':<10} {'before rows/s':>14} {'after rows/s':>14} {'speedup':>8}")
+    for name, row in results["models"].items():
+        print(f"{name:<10} {row['before_rows_per_sec']:>14} {row['after_rows_per_sec']:>14} {row['speedup']:>7}x")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default="sqlite://")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    serialization = subparsers.add_parser("serialization", help="rows/sec of the list serialization path")
+    serialization.add_argument("--rows", type=int, default=20000)
+    serialization.add_argument("--repeat", type=int, default=3)
+    serialization.set_defaults(run=bench_serialization, report=print_serialization)
+
+    favorites = subparsers.add_parser("favorites", help="queries per request on the favorite write endpoints")
+    favorites.add_argument("--rows", type=int, default=1000)
+    favorites.add_argument("--requests", type=int, default=500)
+    favorites.set_defaults(run=bench_favorites, report=print_favorites)
+
+    load = subparsers.add_parser("load", help="req/s and p50/p99 latency of the WSGI and ASGI servers")
+    load.add_argument("--servers", nargs="+", choices=SERVERS, default=list(SERVERS))
+    load.add_argument("--concurrency", type=int, default=256)
+    load.add_argument("--duration", type=float, default=10)
+    load.add_argument("--workers", type=int, default=1, help=WORKERS_HELP)
+    load.add_argument("--rows", type=int, default=1000)
+    load.add_argument("--port", type=int, default=8099)
+    load.set_defaults(run=bench_load, report=print_load)
+
+    routes = subparsers.add_parser("routes", help="every route of app.py on a synthetic dataset")
+    routes.add_argument("--scale", choices=["small", "large"], default="small")
+    routes.add_argument("--targets", nargs="+", choices=["test-client", "gunicorn"], default=["test-client", "gunicorn"])
+    routes.add_argument("--requests", type=int, default=500, help="requests per route")
+    routes.add_argument("--concurrency", type=int, default=16, help="connections to gunicorn")
+    routes.add_argument("--workers", type=int, default=1, help=WORKERS_HELP)
+    routes.add_argument("--port", type=int, default=8099)
+    routes.add_argument("--output", default="bench-results", help="directory for the JSON results ('' to skip)")
+    routes.set_defaults(run=bench_routes, report=print_routes)
+
+    compare = subparsers.add_parser("compare", help="compare two saved `routes` results")
+    compare.add_argument("old")
+    compare.add_argument("new")
+    compare.set_defaults(run=bench_compare, report=print_compare)
+
+    args = parser.parse_args(argv)
+    os.environ["DATABASE_URL"] = args.database_url
+    # Keep the per-request log lines out of the report (servers inherit this)
+    os.environ.setdefault("REQUEST_LOG_LEVEL", "ERROR")
+    results = args.run(args)
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        args.report(results)
+
+
+if __name__ == "__main__":
+    main()
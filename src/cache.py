@@ -0,0 +1,139 @@
+"""
+Read-through cache for the catalog detail endpoints and user favorites.
+
+Serialized JSON is kept as ready-to-send bytes in the backend selected by
+CACHE_URL (see cache_backends.py). Entries are evicted when a committed
+transaction touches the row (see model_events.py), and expire after a TTL
+as a safety net.
+
+Whole responses of the conditional views are cached as well, keyed by
+their ETag (see conditional.py). The ETag changes with the table versions,
+so these entries never need evicting, they just stop being asked for.
+Compressed variants live next to every entry (see compression.py).
+"""
+import json
+import os
+from flask import current_app
+from models import db, Favorite
+from cache_backends import create_backend
+from serialization import serializer_for, dumps_bytes
+from instrumentation import timing
+import model_events
+
+cache_backend = create_backend()
+
+CATALOG_TABLES = {"person", "planet", "starship"}
+
+# Larger responses are rebuilt on every request instead of filling the cache
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get("RESPONSE_CACHE_MAX_BYTES") or 65536)
+ENCODINGS = ("br", "gzip")
+
+
+def cache_key(model, pk):
+    return f"{model.__tablename__}:{pk}"
+
+
+def favorites_key(user_id):
+    return f"favorites:{user_id}"
+
+
+def variant_key(key, encoding):
+    """Key of the compressed body of entry `key` (see compression.py)."""
+    return f"{key}|{encoding}"
+
+
+def encode(data):
+    with timing("encode"):
+        return dumps_bytes(data, current_app.json.sort_keys, current_app.json.default) + b"\n"
+
+
+def get_serialized(model, pk):
+    """Return the encoded JSON body for one row, or None if it doesn't exist.
+
+    The second value tells whether the body came from the cache.
+    """
+    key = cache_key(model, pk)
+    body = cache_backend.get(key)
+    if body is not None:
+        return body, True
+
+    serializer = serializer_for(model)
+    row = db.session.execute(serializer.select().where(model.id == pk)).first()
+    if row is None:
+        return None, False
+    with timing("serialize"):
+        data = serializer.from_row(row)
+    body = encode(data)
+    cache_backend.set(key, body)
+    return body, False
+
+
+def get_serialized_favorites(user_id):
+    """Return the encoded JSON list of a user's favorites and whether it was cached."""
+    key = favorites_key(user_id)
+    body = cache_backend.get(key)
+    if body is not None:
+        return body, True
+
+    favorites = Favorite.query.filter_by(user_id=user_id).order_by(Favorite.id).all()
+    with timing("serialize"):
+        data = [fav.serialize() for fav in favorites]
+    body = encode(data)
+    cache_backend.set(key, body)
+    return body, False
+
+
+def cached_response(body, hit, key=None):
+    response = current_app.response_class(body, mimetype="application/json")
+    response.headers["X-Cache"] = "HIT" if hit else "MISS"
+    response.cache_key = key
+    return response
+
+
+# WHOLE RESPONSES
+def response_key(etag):
+    return f"response:{etag}"
+
+
+def load_response(key):
+    """Rebuild a response stored by store_response(), or None."""
+    packed = cache_backend.get(key)
+    if packed is None:
+        return None
+    head, _, body = packed.partition(b"\n")
+    response = current_app.response_class(body, headers=json.loads(head))
+    response.headers["X-Cache"] = "HIT"
+    response.cache_key = key
+    return response
+
+
+def store_response(key, response):
+    response.headers["X-Cache"] = "MISS"
+    body = response.get_data()
+    if len(body) > RESPONSE_CACHE_MAX_BYTES:
+        return
+    headers = [(name, value) for name, value in response.headers.items() if name not in ("Content-Length", "X-Cache")]
+    cache_backend.set(key, json.dumps(headers).encode() + b"\n" + body)
+    response.cache_key = key
+
+
+@model_events.subscribe
+def _invalidate(changes):
+    keys, prefixes = [], []
+    for table, ids in changes.items():
+        if table in CATALOG_TABLES:
+            # Favorites embed the catalog items, so they go stale with them
+            if ids is None:
+                prefixes.append(f"{table}:")
+            else:
+                keys += [f"{table}:{pk}" for pk in ids]
+            prefixes.append("favorites:")
+        elif table in ("user", "user.favorites"):
+            if ids is None:
+                prefixes.append("favorites:")
+            else:
+                keys += [favorites_key(pk) for pk in ids]
+    if keys or prefixes:
+        # Prefixes cover the compressed variants already
+        keys += [variant_key(key, encoding) for key in keys for encoding in ENCODINGS]
+        cache_backend.invalidate(keys=keys, prefixes=set(prefixes))
@@ -0,0 +1,302 @@
+"""
+Storage backends for the response cache and the table version counters.
+
+    CACHE_URL=memory://                 (default) per-process LRU
+    CACHE_URL=redis://localhost:6379/0  shared between gunicorn workers
+
+The memory backend also keeps the table versions behind the ETags (see
+conditional.py) in its process, so a write handled by one worker would
+leave the others answering 304 and serving cached responses for data
+that changed. With more than one worker the servers log a warning and
+turn it off (see check_workers()): nothing is cached and no ETags are
+sent, until CACHE_URL points at Redis.
+
+The Redis backend keeps a small local LRU in front of Redis. Invalidations
+delete the keys in Redis and are published on a channel, so every worker
+drops its local copy as well.
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class LRUCache:
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def delete_prefix(self, prefix):
+        with self._lock:
+            for key in [k for k in self._data if k.startswith(prefix)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
+
+
+class CacheBackend:
+    """Interface shared by the cache backends."""
+    name = None
+    # False once the process can't cache for itself alone (see check_workers())
+    enabled = True
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value):
+        raise NotImplementedError
+
+    def invalidate(self, keys=(), prefixes=()):
+        raise NotImplementedError
+
+    def bump_versions(self, tables):
+        raise NotImplementedError
+
+    def versions(self, tables):
+        """Return `(epoch, {table: (version, modified_timestamp)})`."""
+        raise NotImplementedError
+
+    def stats(self):
+        raise NotImplementedError
+
+    def after_fork(self):
+        """Drop the state a worker inherits from a preloading master (see gunicorn.conf.py)."""
+
+
+class MemoryBackend(CacheBackend):
+    name = "memory"
+
+    def __init__(self, maxsize=4096, ttl=600):
+        self.store = LRUCache(maxsize, ttl)
+        self.epoch = uuid.uuid4().hex
+        self.started_at = int(time.time())
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        return self.store.get(key) if self.enabled else None
+
+    def set(self, key, value):
+        if self.enabled:
+            self.store.set(key, value)
+
+    def disable(self):
+        self.enabled = False
+        self.store.clear()
+
+    def invalidate(self, keys=(), prefixes=()):
+        for key in keys:
+            self.store.delete(key)
+        for prefix in prefixes:
+            self.store.delete_prefix(prefix)
+
+    def bump_versions(self, tables):
+        now = int(time.time())
+        with self._lock:
+            for table in tables:
+                version, _ = self._versions.get(table, (0, self.started_at))
+                self._versions[table] = (version + 1, now)
+
+    def versions(self, tables):
+        return self.epoch, {t: self._versions.get(t, (0, self.started_at)) for t in tables}
+
+    def after_fork(self):
+        # Every worker counts versions from 0: a shared epoch would let a
+        # restarted worker hand out the ETags of its predecessor for other data
+        self.store.clear()
+        with self._lock:
+            self.epoch = uuid.uuid4().hex
+            self.started_at = int(time.time())
+            self._versions = {}
+
+    def stats(self):
+        return {"backend": self.name, **self.store.stats()}
+
+
+class RedisBackend(CacheBackend):
+    name = "redis"
+
+    def __init__(self, client, ttl=600, local_maxsize=1024, local_ttl=30,
+                 namespace="starwars:", channel="starwars:invalidate"):
+        self.client = client
+        self.ttl = ttl
+        self.namespace = namespace
+        self.channel = channel
+        self.local = LRUCache(local_maxsize, local_ttl)
+        self.hits = 0
+        self.misses = 0
+        self._listener = None
+        self._listener_pid = None
+        self._lock = threading.Lock()
+
+    def _key(self, key):
+        return self.namespace + key
+
+    def _ensure_listener(self):
+        # The listener thread does not survive a fork, start one per worker
+        if self._listener_pid == os.getpid():
+            return
+        with self._lock:
+            if self._listener_pid == os.getpid():
+                return
+            pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{self.channel: self._on_message})
+            self._listener = pubsub.run_in_thread(sleep_time=1, daemon=True)
+            self._listener_pid = os.getpid()
+
+    def after_fork(self):
+        # The listener thread stayed with the master, the local copies may be stale
+        self._listener = None
+        self._listener_pid = None
+        self.local.clear()
+
+    def _on_message(self, message):
+        payload = json.loads(message["data"])
+        self._evict_local(payload.get("keys", ()), payload.get("prefixes", ()))
+
+    def _evict_local(self, keys, prefixes):
+        for key in keys:
+            self.local.delete(key)
+        for prefix in prefixes:
+            self.local.delete_prefix(prefix)
+
+    def get(self, key):
+        self._ensure_listener()
+        value = self.local.get(key)
+        if value is not None:
+            return value
+        value = self.client.get(self._key(key))
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.local.set(key, value)
+        return value
+
+    def set(self, key, value):
+        self._ensure_listener()
+        self.client.set(self._key(key), value, ex=self.ttl)
+        self.local.set(key, value)
+
+    def invalidate(self, keys=(), prefixes=()):
+        keys, prefixes = list(keys), list(prefixes)
+        doomed = [self._key(key) for key in keys]
+        for prefix in prefixes:
+            doomed.extend(self.client.scan_iter(match=self._key(prefix) + "*", count=500))
+        if doomed:
+            self.client.delete(*doomed)
+        self._evict_local(keys, prefixes)
+        self.client.publish(self.channel, json.dumps({"keys": keys, "prefixes": prefixes}))
+
+    def bump_versions(self, tables):
+        now = int(time.time())
+        pipe = self.client.pipeline()
+        for table in tables:
+            pipe.incr(self._key(f"version:{table}"))
+            pipe.set(self._key(f"modified:{table}"), now)
+        pipe.execute()
+
+    def versions(self, tables):
+        tables = list(tables)
+        keys = [self._key("epoch")]
+        for table in tables:
+            keys += [self._key(f"version:{table}"), self._key(f"modified:{table}")]
+        values = self.client.mget(keys)
+        if values[0] is None:
+            # First start, or Redis lost its data: begin a new epoch so old ETags can't match
+            self.client.set(self._key("epoch"), f"{uuid.uuid4().hex}:{int(time.time())}", nx=True)
+            values[0] = self.client.get(self._key("epoch"))
+        epoch = values[0].decode() if isinstance(values[0], bytes) else values[0]
+        started_at = int(epoch.rsplit(":", 1)[1])
+        result = {}
+        for i, table in enumerate(tables):
+            version, modified = values[1 + 2 * i], values[2 + 2 * i]
+            result[table] = (int(version or 0), int(modified or started_at))
+        return epoch, result
+
+    def stats(self):
+        local_hits = self.local.hits
+        lookups = local_hits + self.hits + self.misses
+        return {
+            "backend": self.name,
+            "size": self.local.stats()["size"],
+            "local_hits": local_hits,
+            "hits": local_hits + self.hits,
+            "misses": self.misses,
+            "hit_ratio": (local_hits + self.hits) / lookups if lookups else 0.0,
+        }
+
+
+def check_workers(backend, workers):
+    """Turn the memory:// cache off when several worker processes would each keep their own."""
+    if backend.name == "memory" and workers > 1 and backend.enabled:
+        logger.warning(
+            "CACHE_URL=memory:// keeps the cache and the ETag versions per process, %d workers would "
+            "serve each other's stale data: caching and ETags are off. Point CACHE_URL at Redis "
+            "(redis://...) or run a single worker with more threads.", workers
+        )
+        backend.disable()
+
+
+def create_backend(url=None):
+    url = url or os.getenv("CACHE_URL", "memory://")
+    ttl = int(os.getenv("CATALOG_CACHE_TTL", 600))
+    maxsize = int(os.getenv("CATALOG_CACHE_SIZE", 4096))
+
+    if url.startswith("memory://"):
+        return MemoryBackend(maxsize=maxsize, ttl=ttl)
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("CACHE_URL points to Redis but the 'redis' package is not installed")
+        return RedisBackend(redis.Redis.from_url(url), ttl=ttl, local_maxsize=min(maxsize, 1024))
+    raise RuntimeError(f"Unsupported CACHE_URL '{url}'")
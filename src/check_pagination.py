@@ -0,0 +1,63 @@
+"""
+Checks that following the `Link: rel="next"` headers of a filtered or
+sorted list walks exactly the rows of one big page, with every `filter`
+argument kept from page to page. Runs against a throwaway in-memory DB:
+
+    python src/check_pagination.py
+"""
+import os
+import re
+import sys
+
+os.environ["DATABASE_URL"] = "sqlite://"
+
+from app import create_app
+from models import db
+from synthetic import populate
+
+ROWS = 300
+PAGE_SIZE = 7
+
+# Each query is walked page by page and compared with one page of ROWS
+QUERIES = [
+    "/planets?filter=population>1e5&filter=diameter<5200",
+    "/planets?filter=population>1e5&filter=diameter<5200&sort=-diameter",
+    "/people?filter=height>170,mass<100&filter=height<200&sort=mass",
+]
+
+NEXT_LINK = re.compile(r'<([^>]+)>; rel="next"')
+
+
+def walk(client, path):
+    ids = []
+    url = f"{path}&limit={PAGE_SIZE}"
+    while url:
+        response = client.get(url)
+        assert response.status_code == 200, f"{url}: {response.status_code}"
+        ids += [row["id"] for row in response.get_json()]
+        link = NEXT_LINK.search(response.headers.get("Link", ""))
+        url = link.group(1) if link else None
+    return ids
+
+
+def main():
+    app = create_app(subsystems=())
+    failed = False
+    with app.app_context():
+        db.create_all()
+        populate(people=ROWS, planets=ROWS, starships=ROWS, users=1, favorites_per_user=0)
+        client = app.test_client()
+        for path in QUERIES:
+            expected = [row["id"] for row in client.get(f"{path}&limit={ROWS}").get_json()]
+            pages = walk(client, path)
+            print(f"{path}: {len(pages)} rows in pages of {PAGE_SIZE}, {len(expected)} in one page")
+            if pages != expected:
+                failed = True
+    if failed:
+        print("Paging returned other rows than a single page")
+        sys.exit(1)
+    print("Pages match")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Checks that the user endpoints run a fixed number of SQL queries no matter
+how many users and favorites exist. Runs against a throwaway in-memory DB:
+
+    python src/check_query_counts.py
+"""
+import os
+import sys
+
+os.environ["DATABASE_URL"] = "sqlite://"
+
+from app import create_app
+from models import db, User, Person, Planet, Starship, Favorite
+from instrumentation import assert_max_queries
+
+# users query + favorites + one IN query per favorited kind
+USER_QUERY_BUDGET = 5
+
+
+def populate(user_count):
+    db.session.query(Favorite).delete()
+    db.session.query(User).delete()
+    db.session.query(Person).delete()
+    db.session.query(Planet).delete()
+    db.session.query(Starship).delete()
+
+    person = Person(
+        name="Luke Skywalker", birth_year="19BBY", eye_color="blue", gender="male",
+        hair_color="blond", height=172.0, mass=77.0, skin_color="fair",
+        homeworld="https://www.swapi.tech/api/planets/1",
+    )
+    planet = Planet(
+        name="Tatooine", climate="arid", diameter=10465.0, gravity="1 standard",
+        orbital_period=304.0, population=200000.0, rotation_period=23.0,
+        surface_water=1.0, terrain="desert",
+    )
+    starship = Starship(
+        name="X-wing", model="T-65 X-wing", starship_class="Starfighter",
+        manufacturer="Incom Corporation", cost_in_credits=149999.0, length=12.5,
+        crew="1", passengers="0", max_atmosphering_speed="1050",
+        cargo_capacity=110.0, consumables="1 week",
+    )
+    db.session.add_all([person, planet, starship])
+    db.session.flush()
+
+    for i in range(user_count):
+        user = User(username=f"user_{i}")
+        user.favorites = [
+            Favorite(person_id=person.id),
+            Favorite(planet_id=planet.id),
+            Favorite(starship_id=starship.id),
+        ]
+        db.session.add(user)
+    db.session.commit()
+    db.session.expunge_all()
+
+
+def measure(client):
+    counts = {}
+    with assert_max_queries(USER_QUERY_BUDGET) as counter:
+        client.get("/user")
+    counts["GET /user"] = counter.count
+
+    with assert_max_queries(USER_QUERY_BUDGET) as counter:
+        client.get("/user/1")
+    counts["GET /user/<id>"] = counter.count
+
+    with assert_max_queries(USER_QUERY_BUDGET) as counter:
+        client.get("/user/favorites", headers={"X-Username": "user_0"})
+    counts["GET /user/favorites"] = counter.count
+
+    # Compact favorites skip the item queries of the kinds not expanded
+    for path in ("/user?compact=1", "/user?expand=planet", "/user/favorites?expand=planet"):
+        with assert_max_queries(USER_QUERY_BUDGET) as counter:
+            client.get(path, headers={"X-Username": "user_0"})
+        counts[f"GET {path}"] = counter.count
+    return counts
+
+
+def main():
+    app = create_app(subsystems=())
+    results = {}
+    with app.app_context():
+        db.create_all()
+        client = app.test_client()
+        for user_count in (10, 500):
+            populate(user_count)
+            results[user_count] = measure(client)
+
+    small, large = results.values()
+    for route, count in small.items():
+        print(f"{route}: {count} queries (10 users) / {large[route]} queries (500 users)")
+    if small != large:
+        print("Query count grows with the number of users")
+        sys.exit(1)
+    print("Query counts are constant")
+
+
+if __name__ == "__main__":
+    main()
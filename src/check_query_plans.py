@@ -0,0 +1,108 @@
+"""
+Runs EXPLAIN for the hot queries of the API against a large seeded dataset
+and fails if any of them needs a full table scan. Uses a throwaway
+in-memory SQLite DB by default; point it at an empty Postgres database to
+check the Postgres plans:
+
+    python src/check_query_plans.py
+    python src/check_query_plans.py --database-url postgresql://localhost/plans --rows 200000
+"""
+import argparse
+import json
+import os
+import sys
+
+
+def hot_queries():
+    from sqlalchemy import select, tuple_
+    from models import User, Person, Planet, Starship, Favorite
+
+    return {
+        "user by username": select(User.id).where(User.username == "user_42"),
+        "user by id": select(User).where(User.id == 42),
+        "favorites of a user": select(Favorite).where(Favorite.user_id == 42),
+        "favorite of a user and planet": select(Favorite.id).where(Favorite.user_id == 42, Favorite.planet_id == 7),
+        "who favorited a person": select(Favorite).where(Favorite.person_id == 7),
+        "who favorited a planet": select(Favorite).where(Favorite.planet_id == 7),
+        "who favorited a starship": select(Favorite).where(Favorite.starship_id == 7),
+        "person by id": select(Person).where(Person.id == 7),
+        "planet by id": select(Planet).where(Planet.id == 7),
+        "starship by id": select(Starship).where(Starship.id == 7),
+        "residents of a planet": select(Person).where(Person.planet_id == 7, Person.id > 500).order_by(Person.id).limit(100),
+        "people page": select(Person).where(Person.id > 500).order_by(Person.id).limit(100),
+        "users page": select(User).where(User.id > 500).order_by(User.id).limit(100),
+        "planets by population": select(Planet)
+        .where(Planet.population.isnot(None), Planet.population > 1e9)
+        .order_by(Planet.population, Planet.id).limit(100),
+        "planets sorted by diameter": select(Planet)
+        .where(Planet.diameter.isnot(None), tuple_(Planet.diameter, Planet.id) < (9000.0, 4000))
+        .order_by(Planet.diameter.desc(), Planet.id.desc()).limit(100),
+        "starships sorted by cost": select(Starship)
+        .where(Starship.cost_in_credits.isnot(None), tuple_(Starship.cost_in_credits, Starship.id) > (150000.0, 5000))
+        .order_by(Starship.cost_in_credits, Starship.id).limit(100),
+        "most favorited planets": select(Planet.id, Planet.name, Planet.favorite_count)
+        .where(Planet.favorite_count > 0).order_by(Planet.favorite_count.desc(), Planet.id.desc()).limit(10),
+        "people sorted by height": select(Person).where(Person.height.isnot(None)).order_by(Person.height, Person.id).limit(100),
+    }
+
+
+def sqlite_full_scans(connection, sql):
+    from sqlalchemy import text
+    plan = connection.execute(text(f"EXPLAIN QUERY PLAN {sql}")).all()
+    # "SCAN favorite" reads the whole table, "SEARCH ..." and "... USING INDEX" don't
+    return [row.detail for row in plan if row.detail.startswith("SCAN") and "USING" not in row.detail]
+
+
+def postgres_full_scans(connection, sql):
+    from sqlalchemy import text
+    plan = connection.execute(text(f"EXPLAIN (FORMAT JSON) {sql}")).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    scans = []
+
+    def walk(node):
+        if node["Node Type"] == "Seq Scan":
+            scans.append(f"Seq Scan on {node['Relation Name']}")
+        for child in node.get("Plans", ()):
+            walk(child)
+
+    walk(plan[0]["Plan"])
+    return scans
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default="sqlite://")
+    parser.add_argument("--rows", type=int, default=50000, help="rows per catalog table and users")
+    args = parser.parse_args(argv)
+    os.environ["DATABASE_URL"] = args.database_url
+
+    from sqlalchemy import text
+    from app import create_app
+    app = create_app(subsystems=())
+    from models import db
+    from synthetic import populate
+
+    failures = 0
+    with app.app_context():
+        db.create_all()
+        populate(people=args.rows, planets=args.rows, starships=args.rows, users=args.rows, favorites_per_user=3)
+        dialect = db.engine.dialect
+        full_scans = postgres_full_scans if dialect.name == "postgresql" else sqlite_full_scans
+
+        with db.engine.connect() as connection:
+            connection.execute(text("ANALYZE"))
+            for name, stmt in hot_queries().items():
+                sql = str(stmt.compile(dialect=dialect, compile_kwargs={"literal_binds": True}))
+                scans = full_scans(connection, sql)
+                print(f"{'FAIL' if scans else 'ok':<5} {name}" + (f": {', '.join(scans)}" if scans else ""))
+                failures += bool(scans)
+
+    if failures:
+        print(f"{failures} queries need a full table scan")
+        sys.exit(1)
+    print("All hot queries use an index")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Negotiated response compression.
+
+JSON and text responses of at least COMPRESS_MIN_BYTES (default 1024) are
+compressed with the best encoding the client accepts: brotli (needs the
+optional `brotli` package), then gzip. Smaller responses and streamed
+exports are sent as they are. COMPRESS_MIN_BYTES=0 turns it off.
+
+The ASGI app (asgi.py) compresses its native responses the same way.
+
+A response that carries a `cache_key` attribute (see cache.py and
+conditional.py) is compressed once per encoding: the compressed body is
+kept in the cache backend under "<cache_key>|<encoding>", next to the
+plain one, so repeated requests skip both serialization and compression.
+Compressed responses get a weak ETag, the plain and compressed bodies
+stay interchangeable for revalidation.
+"""
+import gzip
+import os
+from flask import request
+from werkzeug.http import parse_accept_header
+from cache import cache_backend, variant_key
+from instrumentation import timing
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MIN_BYTES = int(os.environ.get("COMPRESS_MIN_BYTES") or 1024)
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+COMPRESSIBLE = {"application/json", "application/x-ndjson", "text/plain", "text/html"}
+
+COMPRESSORS = {"gzip": lambda body: gzip.compress(body, GZIP_LEVEL, mtime=0)}
+if brotli is not None:
+    COMPRESSORS["br"] = lambda body: brotli.compress(body, quality=BROTLI_QUALITY)
+
+# Server preference when the client rates them equally
+PREFERENCE = [encoding for encoding in ("br", "gzip") if encoding in COMPRESSORS]
+
+
+def negotiate(accept_encoding=None):
+    """The encoding to use, or None; reads the request's Accept-Encoding unless given."""
+    if accept_encoding is None:
+        accept_encoding = request.headers.get("Accept-Encoding", "")
+    return parse_accept_header(accept_encoding).best_match(PREFERENCE)
+
+
+def compress(body, encoding):
+    with timing("compress"):
+        return COMPRESSORS[encoding](body)
+
+
+def compressed_body(body, encoding, key=None):
+    """Compress `body`, reusing the cached variant of `key` when there is one."""
+    if key is None:
+        return compress(body, encoding)
+    cached = cache_backend.get(variant_key(key, encoding))
+    if cached is None:
+        cached = compress(body, encoding)
+        cache_backend.set(variant_key(key, encoding), cached)
+    return cached
+
+
+def _eligible(response):
+    return (
+        response.status_code == 200
+        and not response.is_streamed
+        and not response.direct_passthrough
+        and "Content-Encoding" not in response.headers
+        and response.mimetype in COMPRESSIBLE
+        and (response.content_length or 0) >= MIN_BYTES
+    )
+
+
+def setup_compression(app):
+    if not MIN_BYTES:
+        return
+
+    @app.after_request
+    def _compress(response):
+        if not _eligible(response):
+            return response
+        response.vary.add("Accept-Encoding")
+        encoding = negotiate()
+        if encoding is None:
+            return response
+        response.set_data(compressed_body(response.get_data(), encoding, getattr(response, "cache_key", None)))
+        response.headers["Content-Encoding"] = encoding
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
@@ -0,0 +1,99 @@
+"""
+ETag / Last-Modified support for the list endpoints.
+
+Every table has a version counter that is bumped whenever a transaction
+touching it commits (see model_events.py). A response's ETag is derived
+from the versions of the tables it reads plus the request URL and the
+representation (JSON, or a streamed export picked by `Accept`), so a
+conditional request can be answered with 304 before any row is loaded.
+Every response varies on Accept for that reason.
+
+The counters live in the cache backend, so with CACHE_URL pointing at
+Redis every gunicorn worker hands out the same ETags. A fresh backend
+starts a new epoch so old ETags never match again. A memory:// backend
+turned off for several workers (see cache_backends.check_workers()) has
+no counters to share, and the views answer without ETags.
+
+Since the ETag pins down the output, the response itself is cached under
+it too (see cache.py): a repeated request that isn't conditional is still
+answered without running the view. Streamed exports are not cached.
+"""
+import hashlib
+from datetime import datetime, timezone
+from functools import wraps
+from flask import request, make_response
+from cache import cache_backend, response_key, load_response, store_response
+from streaming import wants_stream
+import model_events
+
+
+@model_events.subscribe
+def _bump_versions(changes):
+    cache_backend.bump_versions(changes.keys())
+
+
+def compute_validators(tables, vary=()):
+    """Return the ETag and Last-Modified date for the current request."""
+    headers = {header: request.headers.get(header, "") for header in vary}
+    return validators_for(request.full_path, tables, headers, wants_stream())
+
+
+def validators_for(full_path, tables, headers, stream=False):
+    """Same as compute_validators() for a request given by its path, vary headers and representation."""
+    epoch, versions = cache_backend.versions(tables)
+    parts = [epoch, full_path]
+    if stream:
+        parts.append("stream")
+    parts += [f"{table}={versions[table][0]}" for table in tables]
+    parts += [f"{header}={value}" for header, value in headers.items()]
+    etag = hashlib.sha1("|".join(parts).encode()).hexdigest()
+    modified = max(modified for _, modified in versions.values())
+    return etag, datetime.fromtimestamp(modified, timezone.utc)
+
+
+def is_not_modified(etag, modified):
+    if request.if_none_match:
+        # Weak comparison: compressed responses carry W/"<etag>" (see compression.py)
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since:
+        return modified <= request.if_modified_since
+    return False
+
+
+def _add_vary(response, vary):
+    response.vary.add("Accept")
+    for header in vary:
+        response.vary.add(header)
+    return response
+
+
+def conditional(*tables, vary=()):
+    """Answer conditional GETs for a view whose output depends only on `tables`.
+
+    `vary` lists request headers that also select the response (for example
+    X-Username), they are mixed into the ETag and sent back in `Vary`.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not cache_backend.enabled:
+                return _add_vary(make_response(view(*args, **kwargs)), vary)
+            etag, modified = compute_validators(tables, vary)
+
+            if is_not_modified(etag, modified):
+                response = make_response("", 304)
+            else:
+                key = None if wants_stream() else response_key(etag)
+                response = load_response(key) if key else None
+                if response is None:
+                    response = make_response(view(*args, **kwargs))
+                    if response.status_code != 200:
+                        return _add_vary(response, vary)
+                    if key:
+                        store_response(key, response)
+
+            response.set_etag(etag)
+            response.last_modified = modified
+            return _add_vary(response, vary)
+        return wrapper
+    return decorator
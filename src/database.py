@@ -0,0 +1,162 @@
+"""
+Database URL, engine/pool options and pool metrics.
+
+Pool settings are read from the environment:
+
+    DB_POOL_SIZE=5               connections kept open per worker
+    DB_MAX_OVERFLOW=10           extra connections allowed under load
+    DB_POOL_TIMEOUT=30           seconds to wait for a free connection
+    DB_POOL_RECYCLE=1800         reconnect connections older than this
+    DB_POOL_PRE_PING=1           test connections on checkout (survives DB restarts)
+    DB_STATEMENT_TIMEOUT_MS=     abort statements running longer than this
+    DB_MAX_CONNECTIONS=          connections the server allows for this app
+
+Every gunicorn worker owns a pool, so the app refuses to start when
+WEB_CONCURRENCY * (DB_POOL_SIZE + DB_MAX_OVERFLOW) exceeds DB_MAX_CONNECTIONS.
+The local SQLite fallback runs in WAL mode so readers don't block each other,
+through sqlite3 as well as aiosqlite (asgi.py).
+"""
+import os
+import sqlite3
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.dialects.sqlite.aiosqlite import AsyncAdapt_aiosqlite_connection
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+
+SQLITE_FALLBACK = "sqlite:////tmp/test.db"
+
+# DBAPI connections of the sync and async SQLite drivers
+SQLITE_CONNECTIONS = (sqlite3.Connection, AsyncAdapt_aiosqlite_connection)
+
+
+def database_uri():
+    db_url = os.getenv("DATABASE_URL")
+    if db_url is None:
+        return SQLITE_FALLBACK
+    return db_url.replace("postgres://", "postgresql://")
+
+
+def _env_int(name, default):
+    value = os.getenv(name)
+    return int(value) if value not in (None, "") else default
+
+
+def _env_bool(name, default):
+    value = os.getenv(name)
+    if value in (None, ""):
+        return default
+    return value.lower() in ("1", "true", "yes", "on")
+
+
+class PoolMetrics:
+    def __init__(self):
+        self.checkouts = 0
+        self.connects = 0
+        self.invalidations = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self._lock = threading.Lock()
+
+    def record_connect(self):
+        with self._lock:
+            self.connects += 1
+
+    def record_invalidation(self):
+        with self._lock:
+            self.invalidations += 1
+
+    def record_wait(self, seconds):
+        with self._lock:
+            self.checkouts += 1
+            self.wait_seconds_total += seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+
+
+pool_metrics = PoolMetrics()
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited for a connection."""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_metrics.record_wait(time.perf_counter() - start)
+
+
+def engine_options(uri):
+    if uri.startswith("sqlite"):
+        # Wait for the write lock instead of failing with "database is locked"
+        return {"connect_args": {"timeout": 15}}
+
+    options = {
+        "poolclass": TimedQueuePool,
+        "pool_size": _env_int("DB_POOL_SIZE", 5),
+        "max_overflow": _env_int("DB_MAX_OVERFLOW", 10),
+        "pool_timeout": _env_int("DB_POOL_TIMEOUT", 30),
+        "pool_recycle": _env_int("DB_POOL_RECYCLE", 1800),
+        "pool_pre_ping": _env_bool("DB_POOL_PRE_PING", True),
+    }
+    timeout_ms = _env_int("DB_STATEMENT_TIMEOUT_MS", None)
+    if timeout_ms:
+        if uri.startswith("postgresql"):
+            options["connect_args"] = {"options": f"-c statement_timeout={timeout_ms}"}
+        elif uri.startswith("mysql"):
+            options["connect_args"] = {"init_command": f"SET SESSION max_execution_time={timeout_ms}"}
+    return options
+
+
+def check_pool_budget(options):
+    """Fail fast when all workers together could open more connections than allowed."""
+    max_connections = _env_int("DB_MAX_CONNECTIONS", None)
+    if not max_connections or "pool_size" not in options:
+        return
+    workers = _env_int("WEB_CONCURRENCY", 1)
+    per_worker = options["pool_size"] + options["max_overflow"]
+    if workers * per_worker > max_connections:
+        raise RuntimeError(
+            f"{workers} workers x (DB_POOL_SIZE {options['pool_size']} + DB_MAX_OVERFLOW "
+            f"{options['max_overflow']}) = {workers * per_worker} connections exceeds "
+            f"DB_MAX_CONNECTIONS={max_connections}. Lower the pool settings to at most "
+            f"{max_connections // workers} connections per worker."
+        )
+
+
+@event.listens_for(Engine, "connect")
+def _on_connect(dbapi_connection, connection_record):
+    pool_metrics.record_connect()
+    if isinstance(dbapi_connection, SQLITE_CONNECTIONS):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA busy_timeout=15000")
+        cursor.close()
+
+
+@event.listens_for(Engine, "invalidate")
+def _on_invalidate(dbapi_connection, connection_record, exception):
+    pool_metrics.record_invalidation()
+
+
+def pool_stats(engine):
+    pool = engine.pool
+    stats = {
+        "pool_class": type(pool).__name__,
+        "connects": pool_metrics.connects,
+        "invalidations": pool_metrics.invalidations,
+        "checkouts": pool_metrics.checkouts,
+        "wait_seconds_total": round(pool_metrics.wait_seconds_total, 6),
+        "wait_seconds_max": round(pool_metrics.wait_seconds_max, 6),
+    }
+    if isinstance(pool, QueuePool):
+        stats.update(
+            size=pool.size(),
+            checked_in=pool.checkedin(),
+            checked_out=pool.checkedout(),
+            overflow=max(pool.overflow(), 0),
+        )
+    return stats
@@ -0,0 +1,48 @@
+"""
+Compact favorites for the user endpoints.
+
+    GET /user?compact=1                  favorites as {"kind": "planet", "id": 3}
+    GET /user/favorites?expand=planet    same, with the planets embedded
+
+By default User.serialize() and /user/favorites embed the whole person,
+planet or starship of every favorite. With `compact=1` or `expand=` the
+favorites become references and only the kinds listed in `expand` carry
+their item, so the other kinds are neither loaded nor serialized.
+"""
+from flask import request
+from sqlalchemy.orm import lazyload, selectinload
+from models import Favorite
+from utils import APIException
+
+LABELS = ("person", "planet", "starship")
+# The kind names of the favorite routes are accepted too
+ALIASES = {"people": "person"}
+
+
+def parse_expand():
+    """Return the set of labels to embed, or None for the full representation."""
+    raw = request.args.get("expand")
+    if raw is None:
+        compact = request.args.get("compact", "").lower() in ("1", "true", "yes")
+        return set() if compact else None
+    expand = set()
+    for name in raw.split(","):
+        name = ALIASES.get(name.strip(), name.strip())
+        if not name:
+            continue
+        if name not in LABELS:
+            raise APIException(f"Can't expand '{name}', use {', '.join(LABELS)}", status_code=400)
+        expand.add(name)
+    return expand
+
+
+def item_options(expand, favorites=None):
+    """Loader options that skip the items of Favorite not in `expand`.
+
+    Pass the relationship leading to Favorite (User.favorites) when querying
+    its parent.
+    """
+    lazy = [lazyload(getattr(Favorite, label)) for label in LABELS if label not in expand]
+    if favorites is None:
+        return lazy
+    return [selectinload(favorites).options(*lazy)]
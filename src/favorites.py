@@ -0,0 +1,281 @@
+"""
+Write path for the favorite endpoints.
+
+    POST   /favorite/<kind>/<id>   body: {"username": ...}
+    DELETE /favorite/<kind>/<id>?username=...
+
+The user id comes from the identity cache (see identity.py). Adding a
+favorite is then a single INSERT ... SELECT that checks the item exists
+and relies on the uq_user_* constraints to skip duplicates. Removing one
+is a single DELETE ... RETURNING. The item is only looked up separately
+when the insert did nothing, to pick the error.
+
+    POST   /favorites/bulk   body: {"username": ..., "items": [{"kind": "planet", "id": 1}, ...]}
+    DELETE /favorites/bulk   same body
+
+Bulk requests validate every item with one UNION ALL query and write them
+with one multi-row statement in a single transaction.
+
+Every write also moves the favorite_count of the items in the same
+transaction, with one UPDATE per kind (see popularity.py).
+"""
+from collections import namedtuple
+from flask import current_app, jsonify
+from sqlalchemy import delete, exists, insert, literal, or_, select, union_all, update
+from models import db, Person, Planet, Starship, Favorite
+from utils import APIException
+from cache import get_serialized
+from identity import resolve_user_id
+import model_events
+
+FavoriteKind = namedtuple("FavoriteKind", "model column label")
+
+KINDS = {
+    "planet": FavoriteKind(Planet, Favorite.planet_id, "planet"),
+    "people": FavoriteKind(Person, Favorite.person_id, "person"),
+    "starship": FavoriteKind(Starship, Favorite.starship_id, "starship"),
+}
+
+
+def _insert_ignoring_duplicates(dialect):
+    if dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        return dialect_insert(Favorite).on_conflict_do_nothing()
+    if dialect.name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        return dialect_insert(Favorite).on_conflict_do_nothing()
+    if dialect.name in ("mysql", "mariadb"):
+        return insert(Favorite).prefix_with("IGNORE")
+    raise NotImplementedError(f"Favorites are not supported on {dialect.name}")
+
+
+def count_update(kind, item_ids, delta):
+    """UPDATE adding `delta` to the favorite_count of the items."""
+    model = kind.model
+    return update(model).where(model.id.in_(item_ids)).values(favorite_count=model.favorite_count + delta)
+
+
+def adjust_counts(connection, kind, item_ids, delta):
+    connection.execute(count_update(kind, item_ids, delta))
+
+
+def _adjust_rows(connection, rows, delta):
+    ids = {}
+    for row in rows:
+        kind_name, item_id = _favorite_item(row)
+        ids.setdefault(kind_name, set()).add(item_id)
+    for kind_name, item_ids in ids.items():
+        adjust_counts(connection, KINDS[kind_name], item_ids, delta)
+
+
+def _record_change(favorite_id, user_id):
+    model_events.mark_changed(db.session, "favorite", favorite_id)
+    model_events.mark_changed(db.session, "user.favorites", user_id)
+
+
+def _serialize(kind, favorite_id, user_id, item_id):
+    # Same shape as Favorite.serialize(), with the item taken from the catalog cache
+    body, _ = get_serialized(kind.model, item_id)
+    item = current_app.json.loads(body)
+    data = {"id": favorite_id, "user_id": user_id, "person": None, "planet": None, "starship": None}
+    data[kind.label] = item
+    return data
+
+
+def check_username(username):
+    # JSON bodies can carry any type; only strings are looked up
+    if username is not None and not isinstance(username, str):
+        raise APIException("'username' must be a string", status_code=400)
+
+
+def add_favorite(kind_name, item_id, username):
+    kind = KINDS[kind_name]
+    check_username(username)
+    user_id = resolve_user_id(username)
+    if user_id is None:
+        return jsonify({"error": f"User or {kind.label} not found"}), 404
+
+    connection = db.session.connection()
+    dialect = connection.dialect
+    source = select(literal(user_id), kind.model.id).where(kind.model.id == item_id)
+    stmt = _insert_ignoring_duplicates(dialect).from_select(["user_id", kind.column.key], source)
+
+    if dialect.insert_returning:
+        favorite_id = connection.execute(stmt.returning(Favorite.id)).scalar()
+    else:
+        inserted = connection.execute(stmt).rowcount
+        favorite_id = connection.execute(
+            select(Favorite.id).where(Favorite.user_id == user_id, kind.column == item_id)
+        ).scalar() if inserted else None
+
+    if favorite_id is None:
+        db.session.rollback()
+        if not db.session.execute(select(exists().where(kind.model.id == item_id))).scalar():
+            return jsonify({"error": f"User or {kind.label} not found"}), 404
+        return jsonify({"error": "Favorite already exists"}), 400
+
+    adjust_counts(connection, kind, [item_id], 1)
+    _record_change(favorite_id, user_id)
+    db.session.commit()
+    return jsonify(_serialize(kind, favorite_id, user_id, item_id)), 201
+
+
+def remove_favorite(kind_name, item_id, username):
+    kind = KINDS[kind_name]
+    user_id = resolve_user_id(username)
+    if user_id is None:
+        return jsonify({"error": "User not found"}), 404
+
+    connection = db.session.connection()
+    condition = (Favorite.user_id == user_id) & (kind.column == item_id)
+    if connection.dialect.delete_returning:
+        favorite_id = connection.execute(delete(Favorite).where(condition).returning(Favorite.id)).scalar()
+    else:
+        favorite_id = connection.execute(select(Favorite.id).where(condition)).scalar()
+        if favorite_id is not None:
+            connection.execute(delete(Favorite).where(Favorite.id == favorite_id))
+
+    if favorite_id is None:
+        db.session.rollback()
+        return jsonify({"error": "Favorite not found"}), 404
+
+    adjust_counts(connection, kind, [item_id], -1)
+    _record_change(favorite_id, user_id)
+    db.session.commit()
+    return jsonify({"msg": f"Favorite {kind.label} removed"}), 200
+
+
+# BULK
+MAX_BULK_ITEMS = 1000
+
+
+def _parse_bulk_items(payload):
+    items = payload.get("items") if isinstance(payload, dict) else None
+    if not isinstance(items, list):
+        raise APIException("'items' must be a list of {\"kind\", \"id\"} objects", status_code=400)
+    if len(items) > MAX_BULK_ITEMS:
+        raise APIException(f"At most {MAX_BULK_ITEMS} items per request", status_code=400)
+
+    parsed = []
+    for item in items:
+        kind = item.get("kind") if isinstance(item, dict) else None
+        item_id = item.get("id") if isinstance(item, dict) else None
+        valid = kind in KINDS and isinstance(item_id, int) and not isinstance(item_id, bool)
+        parsed.append((kind, item_id, valid))
+    return parsed
+
+
+def _existing_items(requested):
+    """Return the (kind, id) pairs that exist, in one UNION ALL query."""
+    selects = [
+        select(literal(kind_name).label("kind"), KINDS[kind_name].model.id).where(KINDS[kind_name].model.id.in_(ids))
+        for kind_name, ids in requested.items()
+    ]
+    if not selects:
+        return set()
+    return {tuple(row) for row in db.session.execute(union_all(*selects))}
+
+
+def _favorite_item(row):
+    for kind_name, kind in KINDS.items():
+        item_id = getattr(row, kind.column.key)
+        if item_id is not None:
+            return kind_name, item_id
+
+
+def _resolve_user_id(username):
+    check_username(username)
+    user_id = resolve_user_id(username)
+    if user_id is None:
+        raise APIException("User not found", status_code=404)
+    return user_id
+
+
+def _results(parsed, statuses):
+    results = []
+    for kind, item_id, valid in parsed:
+        status = statuses.get((kind, item_id), "invalid") if valid else "invalid"
+        results.append({"kind": kind, "id": item_id, "status": status})
+    return results
+
+
+def add_favorites_bulk(payload):
+    """Add many favorites in one transaction; returns a status per item.
+
+    Statuses: created, exists, not_found, invalid.
+    """
+    parsed = _parse_bulk_items(payload)
+    user_id = _resolve_user_id(payload.get("username"))
+
+    requested = {}
+    for kind, item_id, valid in parsed:
+        if valid:
+            requested.setdefault(kind, set()).add(item_id)
+    existing = _existing_items(requested)
+    statuses = {key: "not_found" for kind, ids in requested.items() for key in ((kind, i) for i in ids)}
+
+    rows = []
+    for kind_name, item_id in sorted(existing):
+        row = {"user_id": user_id, "person_id": None, "planet_id": None, "starship_id": None}
+        row[KINDS[kind_name].column.key] = item_id
+        rows.append(row)
+        statuses[(kind_name, item_id)] = "exists"
+
+    if rows:
+        connection = db.session.connection()
+        stmt = _insert_ignoring_duplicates(connection.dialect).values(rows)
+        if connection.dialect.insert_returning:
+            inserted = connection.execute(stmt.returning(
+                Favorite.id, Favorite.person_id, Favorite.planet_id, Favorite.starship_id
+            )).all()
+        else:
+            before = {row.id for row in connection.execute(select(Favorite.id).where(Favorite.user_id == user_id))}
+            connection.execute(stmt)
+            inserted = [row for row in connection.execute(
+                select(Favorite.id, Favorite.person_id, Favorite.planet_id, Favorite.starship_id)
+                .where(Favorite.user_id == user_id)
+            ) if row.id not in before]
+        for row in inserted:
+            statuses[_favorite_item(row)] = "created"
+            model_events.mark_changed(db.session, "favorite", row.id)
+        if inserted:
+            _adjust_rows(connection, inserted, 1)
+            model_events.mark_changed(db.session, "user.favorites", user_id)
+    db.session.commit()
+    return jsonify({"results": _results(parsed, statuses)}), 200
+
+
+def remove_favorites_bulk(payload):
+    """Remove many favorites in one statement; returns a status per item.
+
+    Statuses: removed, not_found, invalid.
+    """
+    parsed = _parse_bulk_items(payload)
+    user_id = _resolve_user_id(payload.get("username"))
+
+    requested = {}
+    for kind, item_id, valid in parsed:
+        if valid:
+            requested.setdefault(kind, set()).add(item_id)
+    statuses = {(kind, i): "not_found" for kind, ids in requested.items() for i in ids}
+
+    if requested:
+        connection = db.session.connection()
+        condition = (Favorite.user_id == user_id) & or_(
+            *[KINDS[kind].column.in_(ids) for kind, ids in requested.items()]
+        )
+        columns = (Favorite.id, Favorite.person_id, Favorite.planet_id, Favorite.starship_id)
+        if connection.dialect.delete_returning:
+            removed = connection.execute(delete(Favorite).where(condition).returning(*columns)).all()
+        else:
+            removed = connection.execute(select(*columns).where(condition)).all()
+            if removed:
+                connection.execute(delete(Favorite).where(Favorite.id.in_([row.id for row in removed])))
+        for row in removed:
+            statuses[_favorite_item(row)] = "removed"
+            model_events.mark_changed(db.session, "favorite", row.id)
+        if removed:
+            _adjust_rows(connection, removed, -1)
+            model_events.mark_changed(db.session, "user.favorites", user_id)
+    db.session.commit()
+    return jsonify({"results": _results(parsed, statuses)}), 200
@@ -0,0 +1,84 @@
+"""
+Username -> user id resolution with a cache in front of the database.
+
+Favorites endpoints identify the user by username on every request. The
+id is kept in the cache backend (see cache.py) under two keys, one per
+direction, so a committed change or delete of the User row (for example
+from the admin) evicts it by id.
+"""
+import threading
+from sqlalchemy import select
+from models import db, User
+from cache import cache_backend
+import model_events
+
+
+class IdentityStats:
+    def __init__(self):
+        self.lookups_avoided = 0
+        self.db_lookups = 0
+        self._lock = threading.Lock()
+
+    def record(self, hit):
+        with self._lock:
+            if hit:
+                self.lookups_avoided += 1
+            else:
+                self.db_lookups += 1
+
+    def as_dict(self):
+        return {"lookups_avoided": self.lookups_avoided, "db_lookups": self.db_lookups}
+
+
+identity_stats = IdentityStats()
+
+
+def _name_key(username):
+    return f"identity:name:{username}"
+
+
+def _id_key(user_id):
+    return f"identity:id:{user_id}"
+
+
+def cached_user_id(username):
+    """Return the cached id for this username, or None on a miss."""
+    cached = cache_backend.get(_name_key(username))
+    identity_stats.record(hit=cached is not None)
+    return int(cached) if cached is not None else None
+
+
+def remember_user_id(username, user_id):
+    cache_backend.set(_name_key(username), str(user_id).encode())
+    cache_backend.set(_id_key(user_id), username.encode())
+
+
+def resolve_user_id(username):
+    """Return the id of the user with this username, or None."""
+    if not username:
+        return None
+    user_id = cached_user_id(username)
+    if user_id is not None:
+        return user_id
+
+    user_id = db.session.execute(select(User.id).where(User.username == username)).scalar()
+    if user_id is not None:
+        remember_user_id(username, user_id)
+    return user_id
+
+
+@model_events.subscribe
+def _invalidate(changes):
+    if "user" not in changes:
+        return
+    ids = changes["user"]
+    if ids is None:
+        cache_backend.invalidate(prefixes=["identity:"])
+        return
+    keys = []
+    for user_id in ids:
+        username = cache_backend.get(_id_key(user_id))
+        if username is not None:
+            keys.append(_name_key(username.decode()))
+        keys.append(_id_key(user_id))
+    cache_backend.invalidate(keys=keys)
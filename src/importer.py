@@ -0,0 +1,370 @@
+"""
+Bulk import of JSON, NDJSON and CSV files.
+
+    python src/importer.py people.ndjson planets.csv starships.json
+    python src/importer.py --truncate --table favorite favs.csv
+
+The table is taken from the file name (people, planets, starships, users,
+favorites) unless --table is given. Records are streamed in batches and
+written with executemany of one INSERT, or with COPY on Postgres (psycopg2),
+all files in one transaction. --truncate empties the tables first, along
+with the tables referencing them (favorites), without touching rows one
+by one. People are kept when their planets are emptied: their planet_id
+is set to NULL (see NULLED_REFERENCES), and is only filled in again for
+people imported after the planets.
+
+Keys that are not columns are ignored. People without a planet_id get the
+planet of their homeworld URL, when that planet is loaded (like swapi.py). Strings are converted to the
+type of numeric and boolean columns, where "unknown", "n/a" and "" become
+NULL, or 0 in the float columns that can't be NULL (like swapi.py), so
+SWAPI style values load as they are. Other required columns left NULL
+reject the record.
+
+Written and emptied tables are reported on commit like ORM writes (see
+model_events.py), which moves their versions and ETags and drops their
+cached rows. With CACHE_URL=redis:// the running app sees this at once;
+the memory:// cache lives in the app's own process, restart it after an
+import. The favorite counters are rebuilt after favorites are imported or
+--truncate removed some.
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import time
+from sqlalchemy import Boolean, Float, Integer, func, insert, select, text
+from models import db, User, Person, Planet, Starship, Favorite
+from utils import planet_id_from_url
+import model_events
+
+BATCH_SIZE = 10000
+
+TABLES = {
+    "people": Person, "person": Person,
+    "planets": Planet, "planet": Planet,
+    "starships": Starship, "starship": Starship,
+    "users": User, "user": User,
+    "favorites": Favorite, "favorite": Favorite,
+}
+
+FORMATS = {".json": "json", ".ndjson": "ndjson", ".jsonl": "ndjson", ".csv": "csv"}
+
+NULLS = {"", "unknown", "n/a", "none", "null"}
+
+# References set to NULL when their target table is emptied, instead of emptying their own table
+NULLED_REFERENCES = [Person.__table__.c.planet_id]
+
+
+# READING
+def read_records(path, fmt=None):
+    """Yield the records of a file as dicts."""
+    fmt = fmt or FORMATS.get(os.path.splitext(path)[1].lower())
+    if fmt is None:
+        raise ValueError(f"{path}: unknown format, use --format")
+    with open(path, newline="" if fmt == "csv" else None, encoding="utf-8") as f:
+        if fmt == "csv":
+            yield from csv.DictReader(f)
+        elif fmt == "ndjson":
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            data = json.load(f)
+            # SWAPI dumps wrap the list ({"results": [...]}) or the row ({"properties": {...}})
+            if isinstance(data, dict):
+                data = data.get("results", data.get("result", [data]))
+            for record in data:
+                yield record.get("properties", record) if isinstance(record, dict) else record
+
+
+def _to_float(value):
+    return float(value.replace(",", ""))
+
+
+def _to_bool(value):
+    return value.lower() in ("1", "true", "yes", "t", "y")
+
+
+def converters(model):
+    """Return {column: function} turning a string into the column type."""
+    result = {}
+    for column in model.__table__.columns:
+        if isinstance(column.type, Float):
+            result[column.key] = _to_float
+        elif isinstance(column.type, Boolean):
+            result[column.key] = _to_bool
+        elif isinstance(column.type, Integer):
+            result[column.key] = int
+        else:
+            result[column.key] = str
+    return result
+
+
+def normalize(model, records, source="<records>"):
+    """Keep the column keys of every record and convert them; yields dicts."""
+    columns = model.__table__.columns
+    # Values for keys a record lacks: the id is left to the database, scalar
+    # column defaults are filled in here since the rows skip the ORM
+    defaults = {
+        column.key: column.default.arg for column in columns
+        if column.default is not None and column.default.is_scalar
+    }
+    plan = [(key, None if to_type is str else to_type) for key, to_type in converters(model).items()]
+    # NULL can't be stored in these, unknown numbers become 0
+    zeros = {column.key: 0.0 for column in columns if isinstance(column.type, Float) and not column.nullable}
+    required = [column.key for column in columns if not column.nullable and not column.primary_key]
+    for number, record in enumerate(records, 1):
+        row = {}
+        for key, to_type in plan:
+            if key not in record and (key == "id" or key in defaults):
+                if key in defaults:
+                    row[key] = defaults[key]
+                continue
+            value = record.get(key)
+            if to_type is not None and value.__class__ is str:
+                value = value.strip()
+                try:
+                    value = None if value.lower() in NULLS else to_type(value)
+                except ValueError:
+                    raise ValueError(f"{source}: record {number}: bad value for '{key}': {record[key]!r}")
+            if value is None:
+                value = zeros.get(key)
+            row[key] = value
+        for key in required:
+            if key in row and row[key] is None:
+                raise ValueError(f"{source}: record {number}: missing '{key}'")
+        yield row
+
+
+def resolve_planets(records):
+    """Fill in the planet_id of people from their homeworld URL, for the planets that exist."""
+    planet_ids = None
+    for record in records:
+        planet_id = planet_id_from_url(record.get("homeworld")) if record.get("planet_id") in (None, "") else None
+        if planet_id is not None:
+            if planet_ids is None:
+                planet_ids = set(db.session.scalars(select(Planet.id)))
+            record = dict(record, planet_id=planet_id if planet_id in planet_ids else None)
+        yield record
+
+
+# WRITING
+def _mark_changed(table_names):
+    # Core and driver writes skip the ORM events, report them for the commit
+    for name in table_names:
+        model_events.mark_changed(db.session, name)
+        if name in model_events.PARENTS:
+            model_events.mark_changed(db.session, model_events.PARENTS[name][0])
+
+
+def _with_dependents(tables):
+    names = {table.name for table in tables}
+    changed = True
+    while changed:
+        changed = False
+        for table in db.metadata.sorted_tables:
+            if table.name not in names and any(
+                fk.column.table.name in names for fk in table.foreign_keys if fk.parent not in NULLED_REFERENCES
+            ):
+                names.add(table.name)
+                changed = True
+    return [table for table in reversed(db.metadata.sorted_tables) if table.name in names]
+
+
+def nulled_references(tables):
+    """The NULLED_REFERENCES columns that reset() of `tables` sets to NULL."""
+    names = {table.name for table in tables}
+    return [
+        column for column in NULLED_REFERENCES
+        if column.table.name not in names and any(fk.column.table.name in names for fk in column.foreign_keys)
+    ]
+
+
+def reset(models):
+    """Empty the tables of `models` and of the tables that reference them.
+
+    NULLED_REFERENCES to the emptied tables are set to NULL instead.
+    """
+    connection = db.session.connection()
+    dialect = connection.dialect.name
+    tables = _with_dependents([model.__table__ for model in models])
+    nulled = nulled_references(tables)
+    for column in nulled:
+        connection.execute(column.table.update().where(column.isnot(None)).values({column.key: None}))
+    # Tables still referenced by the kept rows can't be truncated on Postgres
+    referenced = {fk.column.table.name for column in nulled for fk in column.foreign_keys}
+    preparer = connection.dialect.identifier_preparer
+    names = [preparer.quote(table.name) for table in tables]
+    if dialect == "postgresql":
+        truncated = [preparer.quote(table.name) for table in tables if table.name not in referenced]
+        if truncated:
+            connection.execute(text(f"TRUNCATE {', '.join(truncated)} RESTART IDENTITY CASCADE"))
+        for table in tables:
+            if table.name in referenced:
+                connection.execute(text(f"DELETE FROM {preparer.quote(table.name)}"))
+                connection.execute(text("SELECT setval(pg_get_serial_sequence(:table, 'id'), 1, false)"),
+                                   {"table": f'"{table.name}"'})
+    elif dialect in ("mysql", "mariadb"):
+        # TRUNCATE commits implicitly on MySQL
+        connection.execute(text("SET FOREIGN_KEY_CHECKS = 0"))
+        for name in names:
+            connection.execute(text(f"TRUNCATE TABLE {name}"))
+        connection.execute(text("SET FOREIGN_KEY_CHECKS = 1"))
+    else:
+        # SQLite has no TRUNCATE, an unqualified DELETE uses its truncate optimization
+        for name in names:
+            connection.execute(text(f"DELETE FROM {name}"))
+    _mark_changed([table.name for table in tables] + [column.table.name for column in nulled])
+    return [table.name for table in tables]
+
+
+def _copy(connection, table, keys, rows):
+    out = io.StringIO()
+    writer = csv.writer(out)
+    for row in rows:
+        writer.writerow(["\\N" if row.get(key) is None else row[key] for key in keys])
+    out.seek(0)
+    preparer = connection.dialect.identifier_preparer
+    columns = ", ".join(preparer.quote(key) for key in keys)
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY {preparer.quote(table.name)} ({columns}) FROM STDIN WITH (FORMAT csv, NULL '\\N')", out)
+    finally:
+        cursor.close()
+
+
+def _fix_sequence(connection, model):
+    # Explicit ids don't advance the Postgres sequence
+    table = model.__tablename__
+    highest = connection.execute(select(func.max(model.id))).scalar()
+    if highest is not None:
+        connection.execute(text("SELECT setval(pg_get_serial_sequence(:table, 'id'), :value)"),
+                           {"table": f'"{table}"', "value": highest})
+
+
+def _executemany(connection, table, keys, rows):
+    paramstyle = connection.dialect.paramstyle
+    if paramstyle not in ("qmark", "format", "pyformat"):
+        connection.execute(insert(table), rows)
+        return
+    # Plain tuples through the driver, skipping per-row parameter processing
+    preparer = connection.dialect.identifier_preparer
+    placeholder = "?" if paramstyle == "qmark" else "%s"
+    sql = (f"INSERT INTO {preparer.quote(table.name)} ({', '.join(preparer.quote(key) for key in keys)}) "
+           f"VALUES ({', '.join([placeholder] * len(keys))})")
+    connection.exec_driver_sql(sql, [tuple(row[key] for key in keys) for row in rows])
+
+
+def load(model, records, batch_size=BATCH_SIZE, progress=None):
+    """Insert normalized records in batches; returns the number of rows.
+
+    `progress(rows)` is called after every batch.
+    """
+    connection = db.session.connection()
+    use_copy = connection.dialect.name == "postgresql" and connection.dialect.driver == "psycopg2"
+    table = model.__table__
+    count = 0
+    with_ids = False
+
+    def write(batch):
+        nonlocal count, with_ids
+        with_ids = with_ids or "id" in batch[0]
+        if use_copy:
+            _copy(connection, table, list(batch[0]), batch)
+        else:
+            _executemany(connection, table, list(batch[0]), batch)
+        count += len(batch)
+        if progress:
+            progress(count)
+
+    batch = []
+    for row in records:
+        if batch and row.keys() != batch[0].keys():
+            write(batch)
+            batch = []
+        batch.append(row)
+        if len(batch) >= batch_size:
+            write(batch)
+            batch = []
+    if batch:
+        write(batch)
+    if count:
+        _mark_changed([table.name])
+    if with_ids and connection.dialect.name == "postgresql":
+        _fix_sequence(connection, model)
+    return count
+
+
+def load_records(model, records, source="<records>", batch_size=BATCH_SIZE, progress=None):
+    """Normalize and load an iterable of dicts; returns the number of rows."""
+    if model is Person:
+        records = resolve_planets(records)
+    return load(model, normalize(model, records, source), batch_size, progress)
+
+
+# CLI
+def model_for(path, table=None):
+    name = table or os.path.basename(path).split(".")[0].lower()
+    if name not in TABLES:
+        raise ValueError(f"{path}: can't tell the table from the file name, use --table")
+    return TABLES[name]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--table", choices=sorted(TABLES), help="table for every file")
+    parser.add_argument("--format", choices=sorted(set(FORMATS.values())), help="format of every file")
+    parser.add_argument("--truncate", action="store_true", help="empty the target tables first")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    from app import create_app
+    app = create_app(subsystems=())
+
+    try:
+        jobs = [(path, model_for(path, args.table)) for path in args.files]
+    except ValueError as error:
+        sys.exit(str(error))
+    # Parents before children, so favorites can point at rows loaded in the same run
+    order = [table.name for table in db.metadata.sorted_tables]
+    jobs.sort(key=lambda job: order.index(job[1].__tablename__))
+    with app.app_context():
+        started = time.perf_counter()
+        if args.truncate:
+            models = {model for _, model in jobs}
+            nulled = nulled_references(_with_dependents([model.__table__ for model in models]))
+            print(f"emptied {', '.join(reset(models))}", file=sys.stderr)
+            for column in nulled:
+                print(f"set {column.table.name}.{column.key} to NULL", file=sys.stderr)
+
+        total = 0
+        for path, model in jobs:
+            start = time.perf_counter()
+
+            def progress(rows):
+                rate = rows / max(time.perf_counter() - start, 1e-9)
+                print(f"\r{path} -> {model.__tablename__}: {rows} rows ({rate:,.0f} rows/s)", end="", file=sys.stderr)
+
+            try:
+                rows = load_records(model, read_records(path, args.format), path, args.batch_size, progress)
+            except ValueError as error:
+                db.session.rollback()
+                sys.exit(f"\n{error}")
+            elapsed = time.perf_counter() - start
+            print(f"\r{path} -> {model.__tablename__}: {rows} rows in {elapsed:.2f}s "
+                  f"({rows / max(elapsed, 1e-9):,.0f} rows/s)", file=sys.stderr)
+            total += rows
+        db.session.commit()
+        if args.truncate or any(model is Favorite for _, model in jobs):
+            from popularity import reconcile
+            reconcile()
+
+    elapsed = time.perf_counter() - started
+    print(f"imported {total} rows in {elapsed:.2f}s ({total / max(elapsed, 1e-9):,.0f} rows/s)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
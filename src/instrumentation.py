@@ -0,0 +1,199 @@
+"""
+SQL query counting helpers, used to keep an eye on N+1 query patterns,
+and per-request timings.
+
+setup_instrumentation(app) measures every request: SQL statements and the
+time spent in them, plus the time spent serializing rows and encoding
+JSON. The numbers are sent back in a Server-Timing header and logged as
+one JSON line on the "api.requests" logger. Requests running more than
+QUERY_BUDGET statements (default 20, 0 disables it) are logged as a
+warning with the most repeated statement, the usual sign of an N+1 loop.
+Streamed responses are measured up to the first byte only.
+
+Statements and timings are kept per context (contextvars) rather than per
+thread, so the async handlers of asgi.py, which share one thread, each
+measure their own; they report through measure_request() and
+finish_request().
+"""
+import json
+import logging
+import os
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from flask import request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# The RequestMetrics of the request being handled in this context
+_request = ContextVar("request_metrics", default=None)
+# Counters of the statements run in this context; a tuple, replaced rather than mutated,
+# so contexts copied from this one (asyncio tasks) never share a list
+_counters = ContextVar("query_counters", default=())
+
+logger = logging.getLogger("api.requests")
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = []
+
+    def record(self, statement):
+        self.count += 1
+        self.statements.append(statement)
+
+
+def _start_counting(counter):
+    _counters.set(_counters.get() + (counter,))
+
+
+def _stop_counting(counter):
+    _counters.set(tuple(c for c in _counters.get() if c is not counter))
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    for counter in _counters.get():
+        counter.record(statement)
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _time_statement(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    for counter in _counters.get():
+        counter.duration += elapsed
+
+
+@event.listens_for(Engine, "handle_error")
+def _discard_start(exception_context):
+    starts = exception_context.connection.info.get("query_start") if exception_context.connection else None
+    if starts:
+        starts.pop()
+
+
+@contextmanager
+def count_queries():
+    """Count every SQL statement executed in this context inside the block."""
+    counter = QueryCounter()
+    _start_counting(counter)
+    try:
+        yield counter
+    finally:
+        _stop_counting(counter)
+
+
+@contextmanager
+def assert_max_queries(limit):
+    """Fail with AssertionError if the block runs more than `limit` statements."""
+    with count_queries() as counter:
+        yield counter
+    if counter.count > limit:
+        listing = "\n".join(counter.statements)
+        raise AssertionError(f"Expected at most {limit} queries, got {counter.count}:\n{listing}")
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = QueryCounter()
+        self.phases = {}
+
+    def add(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+
+@contextmanager
+def timing(phase):
+    """Add the time spent in the block to `phase` ("serialize", "encode") of the current request."""
+    metrics = _request.get()
+    if metrics is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.add(phase, time.perf_counter() - start)
+
+
+def _server_timing(metrics, total):
+    count = metrics.queries.count
+    entries = [f'db;dur={metrics.queries.duration * 1000:.2f};desc="{count} {"query" if count == 1 else "queries"}"']
+    entries += [f"{phase};dur={seconds * 1000:.2f}" for phase, seconds in metrics.phases.items()]
+    entries.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(entries)
+
+
+QUERY_BUDGET = int(os.environ.get("QUERY_BUDGET") or 20)
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "1") != "0"
+
+
+def _configure_logger():
+    if not logger.handlers:
+        logger.addHandler(logging.StreamHandler())
+        logger.setLevel(os.environ.get("REQUEST_LOG_LEVEL", "INFO").upper())
+        logger.propagate = False
+
+
+@contextmanager
+def measure_request():
+    """Measure a request served outside Flask; yields its RequestMetrics."""
+    _configure_logger()
+    metrics = RequestMetrics()
+    token = _request.set(metrics)
+    _start_counting(metrics.queries)
+    try:
+        yield metrics
+    finally:
+        _stop_counting(metrics.queries)
+        _request.reset(token)
+
+
+def finish_request(metrics, method, path, endpoint, status):
+    """Log the request; returns its Server-Timing header, None with SERVER_TIMING=0."""
+    total = time.perf_counter() - metrics.start
+    queries = metrics.queries
+    record = {
+        "method": method, "path": path, "endpoint": endpoint,
+        "status": status, "duration_ms": round(total * 1000, 2),
+        "db_queries": queries.count, "db_ms": round(queries.duration * 1000, 2),
+        **{f"{phase}_ms": round(seconds * 1000, 2) for phase, seconds in metrics.phases.items()},
+    }
+    if QUERY_BUDGET > 0 and queries.count > QUERY_BUDGET:
+        statement, repeats = Counter(queries.statements).most_common(1)[0]
+        record.update(query_budget=QUERY_BUDGET, most_repeated={"statement": statement, "times": repeats})
+        logger.warning(json.dumps(record))
+    elif logger.isEnabledFor(logging.INFO):
+        logger.info(json.dumps(record))
+    return _server_timing(metrics, total) if SERVER_TIMING else None
+
+
+def setup_instrumentation(app):
+    _configure_logger()
+
+    @app.before_request
+    def _start_metrics():
+        metrics = RequestMetrics()
+        _request.set(metrics)
+        _start_counting(metrics.queries)
+
+    @app.after_request
+    def _report_metrics(response):
+        metrics = _request.get()
+        if metrics is None:
+            return response
+        server_timing = finish_request(metrics, request.method, request.path, request.endpoint, response.status_code)
+        if server_timing:
+            response.headers["Server-Timing"] = server_timing
+        return response
+
+    @app.teardown_request
+    def _stop_metrics(exception):
+        metrics = _request.get()
+        if metrics is not None:
+            _stop_counting(metrics.queries)
+            _request.set(None)
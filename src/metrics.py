@@ -0,0 +1,239 @@
+"""
+Prometheus metrics, served at GET /metrics in the text exposition format.
+
+- http_requests_total and http_request_duration_seconds per route, method
+  and status
+- connection pool gauges and counters (see database.pool_stats)
+- cache and identity cache hits and misses, with the hit ratio
+
+Every process keeps its numbers in memory. With METRICS_DIR set, each
+gunicorn or uvicorn worker also writes them to METRICS_DIR/<pid>.json (at
+most every METRICS_FLUSH_SECONDS, default 5) and whichever worker answers
+/metrics adds up the files of all workers. Counters of workers that exited
+are kept, their gauges are dropped. Empty the directory when deploying.
+"""
+import json
+import os
+import threading
+import time
+from flask import g, request
+from models import db
+from database import pool_stats
+from cache import cache_backend
+from identity import identity_stats
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+HELP = {
+    "http_requests_total": ("counter", "Requests handled, by route, method and status"),
+    "http_request_duration_seconds": ("histogram", "Request latency, by route and method"),
+    "db_pool_size": ("gauge", "Connections kept open by the pools"),
+    "db_pool_checked_out": ("gauge", "Connections currently in use"),
+    "db_pool_overflow": ("gauge", "Connections open beyond the pool size"),
+    "db_pool_checkouts_total": ("counter", "Connection checkouts"),
+    "db_pool_checkout_wait_seconds_total": ("counter", "Time spent waiting for a connection"),
+    "db_pool_connects_total": ("counter", "New database connections"),
+    "db_pool_invalidations_total": ("counter", "Connections dropped after an error"),
+    "cache_hits_total": ("counter", "Cache backend hits (responses and identities)"),
+    "cache_misses_total": ("counter", "Cache backend misses"),
+    "cache_hit_ratio": ("gauge", "Cache backend hits / lookups"),
+    "identity_cache_hits_total": ("counter", "Username lookups answered from the cache"),
+    "identity_cache_misses_total": ("counter", "Username lookups that went to the database"),
+    "identity_cache_hit_ratio": ("gauge", "Identity cache hits / lookups"),
+}
+
+
+def _labels(**labels):
+    return ",".join(f'{name}="{value}"' for name, value in labels.items())
+
+
+class Registry:
+    def __init__(self):
+        self.requests = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, route, method, status, seconds):
+        with self._lock:
+            key = _labels(route=route, method=method, status=status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            key = _labels(route=route, method=method)
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {"buckets": [0] * len(BUCKETS), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    histogram["buckets"][i] += 1
+            histogram["sum"] += seconds
+            histogram["count"] += 1
+
+    def snapshot(self):
+        """Numbers of this process, as written to METRICS_DIR."""
+        pool = pool_stats(db.engine)
+        cache = cache_backend.stats()
+        identity = identity_stats.as_dict()
+        with self._lock:
+            counters = {
+                "http_requests_total": dict(self.requests),
+                "db_pool_checkouts_total": {"": pool["checkouts"]},
+                "db_pool_checkout_wait_seconds_total": {"": pool["wait_seconds_total"]},
+                "db_pool_connects_total": {"": pool["connects"]},
+                "db_pool_invalidations_total": {"": pool["invalidations"]},
+                "cache_hits_total": {"": cache["hits"]},
+                "cache_misses_total": {"": cache["misses"]},
+                "identity_cache_hits_total": {"": identity["lookups_avoided"]},
+                "identity_cache_misses_total": {"": identity["db_lookups"]},
+            }
+            histograms = {
+                "http_request_duration_seconds": {
+                    key: {**value, "buckets": list(value["buckets"])} for key, value in self.histograms.items()
+                },
+            }
+        gauges = {
+            name: {"": pool[key]}
+            for name, key in (("db_pool_size", "size"), ("db_pool_checked_out", "checked_out"), ("db_pool_overflow", "overflow"))
+            if key in pool
+        }
+        return {"pid": os.getpid(), "counters": counters, "histograms": histograms, "gauges": gauges}
+
+
+registry = Registry()
+
+
+# MULTIPROCESS
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def write_snapshot(directory, snapshot):
+    path = os.path.join(directory, f"{snapshot['pid']}.json")
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(snapshot, f)
+    os.replace(f"{path}.tmp", path)
+
+
+def read_snapshots(directory, own):
+    snapshots = [own]
+    for name in os.listdir(directory):
+        if not name.endswith(".json") or name == f"{own['pid']}.json":
+            continue
+        try:
+            with open(os.path.join(directory, name)) as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            continue  # being replaced or half written
+    return snapshots
+
+
+def aggregate(snapshots):
+    total = {"counters": {}, "histograms": {}, "gauges": {}}
+    for snapshot in snapshots:
+        for name, series in snapshot["counters"].items():
+            merged = total["counters"].setdefault(name, {})
+            for key, value in series.items():
+                merged[key] = merged.get(key, 0) + value
+        for name, series in snapshot["histograms"].items():
+            merged = total["histograms"].setdefault(name, {})
+            for key, value in series.items():
+                into = merged.setdefault(key, {"buckets": [0] * len(BUCKETS), "sum": 0.0, "count": 0})
+                into["buckets"] = [a + b for a, b in zip(into["buckets"], value["buckets"])]
+                into["sum"] += value["sum"]
+                into["count"] += value["count"]
+        if snapshot is snapshots[0] or _alive(snapshot["pid"]):
+            for name, series in snapshot["gauges"].items():
+                merged = total["gauges"].setdefault(name, {})
+                for key, value in series.items():
+                    merged[key] = merged.get(key, 0) + value
+
+    counters = total["counters"]
+    for prefix in ("cache", "identity_cache"):
+        hits = counters.get(f"{prefix}_hits_total", {}).get("", 0)
+        lookups = hits + counters.get(f"{prefix}_misses_total", {}).get("", 0)
+        total["gauges"][f"{prefix}_hit_ratio"] = {"": hits / lookups if lookups else 0.0}
+    return total
+
+
+# EXPOSITION
+def _series(name, key, value):
+    return f"{name}{{{key}}} {value}" if key else f"{name} {value}"
+
+
+def render(total):
+    lines = []
+    for name, (kind, text) in HELP.items():
+        series = total["counters"].get(name) or total["gauges"].get(name) or total["histograms"].get(name)
+        if not series:
+            continue
+        lines += [f"# HELP {name} {text}", f"# TYPE {name} {kind}"]
+        if kind != "histogram":
+            lines += [_series(name, key, value) for key, value in sorted(series.items())]
+            continue
+        for key, value in sorted(series.items()):
+            prefix = f"{key}," if key else ""
+            for bound, count in zip(BUCKETS, value["buckets"]):
+                lines.append(_series(f"{name}_bucket", f'{prefix}le="{bound}"', count))
+            lines.append(_series(f"{name}_bucket", f'{prefix}le="+Inf"', value["count"]))
+            lines.append(_series(f"{name}_sum", key, round(value["sum"], 6)))
+            lines.append(_series(f"{name}_count", key, value["count"]))
+    return "\n".join(lines) + "\n"
+
+
+METRICS_DIR = os.environ.get("METRICS_DIR")
+FLUSH_SECONDS = float(os.environ.get("METRICS_FLUSH_SECONDS") or 5)
+_last_flush = [0.0]
+
+
+def flush_due():
+    """True at most once every FLUSH_SECONDS, the caller then calls flush()."""
+    now = time.monotonic()
+    if not METRICS_DIR or now - _last_flush[0] <= FLUSH_SECONDS:
+        return False
+    _last_flush[0] = now
+    return True
+
+
+def flush(snapshot=None):
+    """Write this process's snapshot to METRICS_DIR; needs an app context (for the pool stats)."""
+    _last_flush[0] = time.monotonic()
+    write_snapshot(METRICS_DIR, snapshot or registry.snapshot())
+
+
+def setup_metrics(app):
+    if METRICS_DIR:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def _observe(response):
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        registry.observe(route, request.method, response.status_code, time.perf_counter() - g.metrics_start)
+        g.metrics_observed = True
+        if flush_due():
+            flush()
+        return response
+
+    @app.teardown_request
+    def _observe_error(exception):
+        # after_request is skipped when a view raises
+        if "metrics_start" in g and "metrics_observed" not in g:
+            route = request.url_rule.rule if request.url_rule else "unmatched"
+            registry.observe(route, request.method, 500, time.perf_counter() - g.metrics_start)
+
+    @app.route("/metrics", methods=["GET"])
+    def metrics():
+        snapshot = registry.snapshot()
+        snapshots = [snapshot]
+        if METRICS_DIR:
+            flush(snapshot)
+            snapshots = read_snapshots(METRICS_DIR, snapshot)
+        body = render(aggregate(snapshots))
+        return app.response_class(body, mimetype="text/plain; version=0.0.4")
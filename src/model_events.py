@@ -0,0 +1,80 @@
+"""
+Collects the rows changed by each transaction and notifies subscribers
+once it commits. Caches and indexes use this to drop stale entries.
+
+Subscribers receive a dict of `{table_name: ids}` where `ids` is a set of
+primary keys, or None when a bulk statement touched an unknown set of rows.
+A change to a child row is also reported against the parent collection,
+e.g. adding a favorite reports the user id under "user.favorites".
+"""
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+_subscribers = []
+
+# Child table -> (parent collection, foreign key column)
+PARENTS = {"favorite": ("user.favorites", "user_id")}
+
+
+def subscribe(callback):
+    _subscribers.append(callback)
+    return callback
+
+
+def _pending(session):
+    return session.info.setdefault("changed_rows", {})
+
+
+def _mark(session, table, pk):
+    pending = _pending(session)
+    if pk is None:
+        pending[table] = None
+    elif table not in pending:
+        pending[table] = {pk}
+    elif pending[table] is not None:
+        pending[table].add(pk)
+
+
+def mark_changed(session, table, pk=None):
+    """Record a change made with a Core statement that bypasses the ORM."""
+    _mark(session, table, pk)
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_flushed(session, flush_context):
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        table = getattr(obj, "__tablename__", None)
+        if table is None:
+            continue
+        _mark(session, table, getattr(obj, "id", None))
+        if table in PARENTS:
+            parent, column = PARENTS[table]
+            _mark(session, parent, getattr(obj, column, None))
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _collect_bulk(orm_execute_state):
+    # session.query(Model).delete(), update(Model) and insert(Model) skip the flush
+    if orm_execute_state.is_select:
+        return
+    mapper = orm_execute_state.bind_mapper
+    if mapper is None:
+        return
+    table = mapper.local_table.name
+    _mark(orm_execute_state.session, table, None)
+    if table in PARENTS:
+        _mark(orm_execute_state.session, PARENTS[table][0], None)
+
+
+@event.listens_for(Session, "after_commit")
+def _notify(session):
+    changes = session.info.pop("changed_rows", None)
+    if not changes:
+        return
+    for callback in _subscribers:
+        callback(changes)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard(session):
+    session.info.pop("changed_rows", None)
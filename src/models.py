@@ -1,6 +1,8 @@
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import String, Boolean, Float, ForeignKey, UniqueConstraint
-from sqlalchemy.orm import Mapped, mapped_column, relationship
+from sqlalchemy import String, Boolean, Float, Integer, ForeignKey, Index, UniqueConstraint
+from sqlalchemy.orm import Mapped, mapped_column, relationship, validates
+from serialization import serializer_for
+from utils import planet_id_from_url
 
 db = SQLAlchemy()
 
@@ -11,14 +13,19 @@ class User(db.Model):
     username: Mapped[str] = mapped_column(String(80), unique=True, nullable=False)
     is_active: Mapped[bool] = mapped_column(Boolean(), default=True, nullable=False)
 
-    favorites = relationship("Favorite", back_populates="user", cascade="all, delete-orphan")
+    # selectin keeps User.serialize() at one extra query for all favorites,
+    # instead of one per user
+    favorites = relationship("Favorite", back_populates="user", cascade="all, delete-orphan", lazy="selectin")
 
-    def serialize(self):
+    def serialize(self, expand=None):
+        """Favorites embed their items, or are references when `expand` is a set (see expand.py)."""
         return {
             "id": self.id,
             "username": self.username,
             "is_active": self.is_active,
-            "favorites": [fav.serialize() for fav in self.favorites],
+            "favorites": [
+                fav.serialize() if expand is None else fav.reference(expand) for fav in self.favorites
+            ],
         }
 
 
@@ -34,22 +41,35 @@ class Person(db.Model):
     mass: Mapped[float] = mapped_column(Float)
     skin_color: Mapped[str] = mapped_column(String(50))
     homeworld: Mapped[str] = mapped_column(String(200))
+    # Parsed from the homeworld URL (see swapi.py), indexed for /planets/<id>/residents
+    planet_id: Mapped[int] = mapped_column(ForeignKey("planet.id"), nullable=True, index=True)
+    # Maintained by favorites.py, rebuilt by popularity.py; deferred keeps it out of serialize()
+    favorite_count: Mapped[int] = mapped_column(Integer, default=0, server_default="0", nullable=False, deferred=True)
+
+    # (column, id) serves the filters, the sort and its keyset cursor on the list endpoint,
+    # (favorite_count, id) the leaderboard
+    __table_args__ = (
+        Index("ix_person_height_id", "height", "id"),
+        Index("ix_person_mass_id", "mass", "id"),
+        Index("ix_person_favorite_count_id", "favorite_count", "id"),
+    )
 
     favorites = relationship("Favorite", back_populates="person")
+    planet = relationship("Planet", back_populates="residents")
+
+    @validates("homeworld")
+    def _set_planet_id(self, key, homeworld):
+        # Like the backfill of migration 7c41d2a9e8b5: a planet that isn't loaded leaves it NULL
+        planet_id = planet_id_from_url(homeworld)
+        if planet_id is not None:
+            with db.session.no_autoflush:
+                if db.session.get(Planet, planet_id) is None:
+                    planet_id = None
+        self.planet_id = planet_id
+        return homeworld
 
     def serialize(self):
-        return {
-            "id": self.id,
-            "name": self.name,
-            "birth_year": self.birth_year,
-            "eye_color": self.eye_color,
-            "gender": self.gender,
-            "hair_color": self.hair_color,
-            "height": self.height,
-            "mass": self.mass,
-            "skin_color": self.skin_color,
-            "homeworld": self.homeworld,
-        }
+        return serializer_for(Person).from_object(self)
 
 
 class Planet(db.Model):
@@ -64,22 +84,19 @@ class Planet(db.Model):
     rotation_period: Mapped[float] = mapped_column(Float)
     surface_water: Mapped[float] = mapped_column(Float)
     terrain: Mapped[str] = mapped_column(String(100))
+    favorite_count: Mapped[int] = mapped_column(Integer, default=0, server_default="0", nullable=False, deferred=True)
+
+    __table_args__ = (
+        Index("ix_planet_population_id", "population", "id"),
+        Index("ix_planet_diameter_id", "diameter", "id"),
+        Index("ix_planet_favorite_count_id", "favorite_count", "id"),
+    )
 
     favorites = relationship("Favorite", back_populates="planet")
+    residents = relationship("Person", back_populates="planet")
 
     def serialize(self):
-        return {
-            "id": self.id,
-            "name": self.name,
-            "climate": self.climate,
-            "diameter": self.diameter,
-            "gravity": self.gravity,
-            "orbital_period": self.orbital_period,
-            "population": self.population,
-            "rotation_period": self.rotation_period,
-            "surface_water": self.surface_water,
-            "terrain": self.terrain,
-        }
+        return serializer_for(Planet).from_object(self)
 
 
 class Starship(db.Model):
@@ -96,33 +113,30 @@ class Starship(db.Model):
     max_atmosphering_speed: Mapped[str] = mapped_column(String(50))
     cargo_capacity: Mapped[float] = mapped_column(Float)
     consumables: Mapped[str] = mapped_column(String(50))
+    favorite_count: Mapped[int] = mapped_column(Integer, default=0, server_default="0", nullable=False, deferred=True)
+
+    __table_args__ = (
+        Index("ix_starship_cost_in_credits_id", "cost_in_credits", "id"),
+        Index("ix_starship_length_id", "length", "id"),
+        Index("ix_starship_cargo_capacity_id", "cargo_capacity", "id"),
+        Index("ix_starship_favorite_count_id", "favorite_count", "id"),
+    )
 
     favorites = relationship("Favorite", back_populates="starship")
 
     def serialize(self):
-        return {
-            "id": self.id,
-            "name": self.name,
-            "model": self.model,
-            "starship_class": self.starship_class,
-            "manufacturer": self.manufacturer,
-            "cost_in_credits": self.cost_in_credits,
-            "length": self.length,
-            "crew": self.crew,
-            "passengers": self.passengers,
-            "max_atmosphering_speed": self.max_atmosphering_speed,
-            "cargo_capacity": self.cargo_capacity,
-            "consumables": self.consumables,
-        }
+        return serializer_for(Starship).from_object(self)
 
 
 class Favorite(db.Model):
     __tablename__ = "favorite"
     id: Mapped[int] = mapped_column(primary_key=True)
     user_id: Mapped[int] = mapped_column(ForeignKey("user.id"), nullable=False)
-    person_id: Mapped[int] = mapped_column(ForeignKey("person.id"), nullable=True)
-    planet_id: Mapped[int] = mapped_column(ForeignKey("planet.id"), nullable=True)
-    starship_id: Mapped[int] = mapped_column(ForeignKey("starship.id"), nullable=True)
+    # user_id lookups use the uq_user_* constraints below, the item columns
+    # need their own index for "who favorited X" and Person/Planet/Starship.favorites
+    person_id: Mapped[int] = mapped_column(ForeignKey("person.id"), nullable=True, index=True)
+    planet_id: Mapped[int] = mapped_column(ForeignKey("planet.id"), nullable=True, index=True)
+    starship_id: Mapped[int] = mapped_column(ForeignKey("starship.id"), nullable=True, index=True)
 
     __table_args__ = (
         UniqueConstraint("user_id", "person_id", name="uq_user_person"),
@@ -131,9 +145,11 @@ class Favorite(db.Model):
     )
 
     user = relationship("User", back_populates="favorites")
-    person = relationship("Person", back_populates="favorites")
-    planet = relationship("Planet", back_populates="favorites")
-    starship = relationship("Starship", back_populates="favorites")
+    # Batch-load the favorited items with one IN query per kind, so
+    # Favorite.serialize() never triggers a lazy load per row
+    person = relationship("Person", back_populates="favorites", lazy="selectin")
+    planet = relationship("Planet", back_populates="favorites", lazy="selectin")
+    starship = relationship("Starship", back_populates="favorites", lazy="selectin")
 
     def serialize(self):
         return {
@@ -143,3 +159,13 @@ class Favorite(db.Model):
             "planet": self.planet.serialize() if self.planet else None,
             "starship": self.starship.serialize() if self.starship else None,
         }
+
+    def reference(self, expand=()):
+        """{"kind", "id"} of the favorited item, with the item itself if its kind is in `expand`."""
+        for kind in ("person", "planet", "starship"):
+            item_id = getattr(self, f"{kind}_id")
+            if item_id is not None:
+                data = {"kind": kind, "id": item_id}
+                if kind in expand:
+                    data[kind] = getattr(self, kind).serialize()
+                return data
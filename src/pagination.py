@@ -0,0 +1,196 @@
+"""
+Keyset (cursor) pagination and column projection for the list endpoints.
+
+    GET /people?limit=50&after=120&fields=name,height
+
+Pages are ordered by `id`; `after` is the last id of the previous page.
+The body stays a plain JSON array, the next page is advertised through
+the `Link` and `X-Next-Cursor` response headers.
+
+The numeric columns of NUMERIC_COLUMNS can be filtered and sorted on, in SQL:
+
+    GET /planets?filter=population>1e9,diameter<=12000&sort=-diameter
+
+`filter` takes comma separated comparisons (=, !=, >, >=, <, <=), `sort` one
+column, descending with a leading "-". Sorted pages are ordered by
+(column, id) and their cursor is "value,id"; rows without a value are left
+out. Every whitelisted column has a (column, id) index.
+"""
+import re
+from sqlalchemy import tuple_
+from flask import request, jsonify, url_for
+from utils import APIException
+from models import db, Person, Planet, Starship
+from serialization import serializer_for
+from instrumentation import timing
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# Filterable and sortable columns, each backed by a (column, id) index
+NUMERIC_COLUMNS = {
+    Person: ("height", "mass"),
+    Planet: ("population", "diameter"),
+    Starship: ("cost_in_credits", "length", "cargo_capacity"),
+}
+
+OPERATORS = {
+    "=": lambda column, value: column == value,
+    "!=": lambda column, value: column != value,
+    ">": lambda column, value: column > value,
+    ">=": lambda column, value: column >= value,
+    "<": lambda column, value: column < value,
+    "<=": lambda column, value: column <= value,
+}
+
+_COMPARISON = re.compile(r"^\s*(\w+)\s*(!=|>=|<=|=|>|<)\s*(\S+)\s*$")
+
+
+def _int_arg(name, default):
+    value = request.args.get(name)
+    if value is None or value == "":
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise APIException(f"'{name}' must be an integer", status_code=400)
+
+
+def _float(value, name):
+    try:
+        return float(value)
+    except ValueError:
+        raise APIException(f"'{name}' must be a number", status_code=400)
+
+
+def _numeric_column(model, name, arg):
+    allowed = NUMERIC_COLUMNS.get(model, ())
+    if not allowed:
+        raise APIException(f"'{arg}' is not supported here", status_code=400)
+    if name not in allowed:
+        raise APIException(f"Can't use '{name}' in '{arg}', allowed: {', '.join(allowed)}", status_code=400)
+    return getattr(model, name)
+
+
+def parse_page_args(sorted_by=None):
+    limit = _int_arg("limit", DEFAULT_PAGE_SIZE)
+    if sorted_by is None:
+        after = _int_arg("after", None)
+    else:
+        after = parse_sort_cursor(request.args["after"]) if request.args.get("after") else None
+    if limit < 1 or limit > MAX_PAGE_SIZE:
+        raise APIException(f"'limit' must be between 1 and {MAX_PAGE_SIZE}", status_code=400)
+    return limit, after
+
+
+def parse_filters(model):
+    """Return the SQL conditions of ?filter=, e.g. population>1e9,diameter<=12000."""
+    conditions = []
+    for raw in request.args.getlist("filter"):
+        for part in raw.split(","):
+            if not part.strip():
+                continue
+            match = _COMPARISON.match(part)
+            if match is None:
+                raise APIException(f"Bad filter '{part}', expected <column><op><number>", status_code=400)
+            name, op, value = match.groups()
+            conditions.append(OPERATORS[op](_numeric_column(model, name, "filter"), _float(value, "filter")))
+    return conditions
+
+
+def parse_sort(model):
+    """Return (column, descending) for ?sort=; the column is None for the id order."""
+    raw = request.args.get("sort", "").strip()
+    if not raw:
+        return None, False
+    descending = raw.startswith("-")
+    return _numeric_column(model, raw.lstrip("-"), "sort"), descending
+
+
+def parse_sort_cursor(raw):
+    """Split the "value,id" cursor of sorted pages."""
+    value, _, last_id = raw.rpartition(",")
+    try:
+        return float(value), int(last_id)
+    except ValueError:
+        raise APIException("'after' must be the X-Next-Cursor of the previous page", status_code=400)
+
+
+def parse_fields(model):
+    """Return the column names requested with ?fields=, or None for full rows."""
+    raw = request.args.get("fields")
+    if not raw:
+        return None
+    columns = serializer_for(model).keys
+    fields = ["id"]
+    for name in raw.split(","):
+        name = name.strip()
+        if not name or name in fields:
+            continue
+        if name not in columns:
+            raise APIException(f"Unknown field '{name}'", status_code=400)
+        fields.append(name)
+    return fields
+
+
+def next_page_url(after, limit):
+    # Every value of repeated arguments (filter=...&filter=...) is kept
+    args = request.args.to_dict(flat=False)
+    args.update(after=[after], limit=[limit])
+    return url_for(request.endpoint, **(request.view_args or {}), **args)
+
+
+def paginate(model, hydrate=False, where=None, options=(), serialize=None):
+    """Serialize one page of `model` as a JSON response.
+
+    Rows are selected as plain column tuples unless `hydrate` is set, which
+    loads ORM objects with the loader `options` and uses `serialize(obj)`,
+    their serialize() by default (needed for nested data).
+    `where` narrows the rows, e.g. Person.planet_id == 1.
+    """
+    column, descending = parse_sort(model)
+    limit, after = parse_page_args(column)
+    fields = parse_fields(model)
+
+    objects = hydrate and not fields
+    if objects:
+        query = model.query.options(*options)
+        serialize = serialize or model.serialize
+    else:
+        serializer = serializer_for(model, fields)
+        attributes = serializer.attributes
+        if column is not None:
+            # Selected last for the cursor; from_row() stops at its own keys
+            attributes = [*attributes, column]
+        query = db.session.query(*attributes)
+        serialize = serializer.from_row
+    if where is not None:
+        query = query.filter(where)
+    query = query.filter(*parse_filters(model))
+
+    if column is None:
+        if after is not None:
+            query = query.filter(model.id > after)
+        query = query.order_by(model.id)
+    else:
+        order = (column, model.id)
+        query = query.filter(column.isnot(None))
+        if after is not None:
+            query = query.filter(tuple_(*order) < after if descending else tuple_(*order) > after)
+        query = query.order_by(*(c.desc() for c in order) if descending else order)
+    # Fetch one extra row to know whether there is a next page
+    rows = query.limit(limit + 1).all()
+    has_more = len(rows) > limit
+    with timing("serialize"):
+        items = [serialize(row) for row in rows[:limit]]
+
+    response = jsonify(items)
+    if has_more:
+        cursor = items[-1]["id"]
+        if column is not None:
+            last = rows[limit - 1]
+            value = getattr(last, column.key) if objects else last[-1]
+            cursor = f"{value!r},{cursor}"
+        response.headers["X-Next-Cursor"] = str(cursor)
+        response.headers["Link"] = f'<{next_page_url(cursor, limit)}>; rel="next"'
+    return response
@@ -0,0 +1,119 @@
+"""
+Favorite counters and the most favorited leaderboard.
+
+    GET /leaderboard?kind=planet&top=10
+    python src/popularity.py            # rebuild every counter from `favorite`
+
+Person, Planet and Starship carry a favorite_count column. The favorite
+endpoints move it in the same transaction as their write (see
+favorites.py), and the ORM events below do the same for favorites written
+through the ORM (admin, cascades). Writes that bypass both, such as the
+importer or a raw DELETE, leave the counters behind until reconcile()
+runs. The leaderboard reads the top rows of the (favorite_count, id)
+index, it never aggregates `favorite`.
+"""
+import sys
+import time
+from flask import request
+from sqlalchemy import event, func, inspect, select, update
+from models import db, Favorite
+from utils import APIException
+from favorites import KINDS, adjust_counts
+import model_events
+
+DEFAULT_TOP = 10
+MAX_TOP = 100
+
+
+# ORM WRITES
+def _item(target, kind):
+    return getattr(target, kind.column.key)
+
+
+@event.listens_for(Favorite, "after_insert")
+def _count_insert(mapper, connection, target):
+    for kind in KINDS.values():
+        if _item(target, kind) is not None:
+            adjust_counts(connection, kind, [_item(target, kind)], 1)
+
+
+@event.listens_for(Favorite, "after_delete")
+def _count_delete(mapper, connection, target):
+    for kind in KINDS.values():
+        if _item(target, kind) is not None:
+            adjust_counts(connection, kind, [_item(target, kind)], -1)
+
+
+@event.listens_for(Favorite, "after_update")
+def _count_update(mapper, connection, target):
+    state = inspect(target)
+    for kind in KINDS.values():
+        history = state.attrs[kind.column.key].history
+        for item_id in history.deleted or ():
+            if item_id is not None:
+                adjust_counts(connection, kind, [item_id], -1)
+        for item_id in history.added or ():
+            if item_id is not None:
+                adjust_counts(connection, kind, [item_id], 1)
+
+
+# RECONCILIATION
+def reconcile():
+    """Rebuild favorite_count from `favorite`; returns {table: rows fixed}."""
+    fixed = {}
+    for kind in KINDS.values():
+        model = kind.model
+        actual = (
+            select(func.count(Favorite.id)).where(kind.column == model.id).correlate(model).scalar_subquery()
+        )
+        # Core statement: the counter is not serialized, cached items stay valid
+        result = db.session.connection().execute(
+            update(model).where(model.favorite_count != actual).values(favorite_count=actual)
+        )
+        fixed[model.__tablename__] = result.rowcount
+    if any(fixed.values()):
+        # Pseudo table, so the leaderboard ETags change (see conditional.py)
+        model_events.mark_changed(db.session, "favorite_count")
+    db.session.commit()
+    return fixed
+
+
+# LEADERBOARD
+def parse_leaderboard_args():
+    kind_name = request.args.get("kind")
+    if kind_name not in KINDS:
+        raise APIException(f"'kind' must be one of {', '.join(KINDS)}", status_code=400)
+    try:
+        top = int(request.args.get("top") or DEFAULT_TOP)
+    except ValueError:
+        raise APIException("'top' must be an integer", status_code=400)
+    if top < 1 or top > MAX_TOP:
+        raise APIException(f"'top' must be between 1 and {MAX_TOP}", status_code=400)
+    return kind_name, top
+
+
+def leaderboard(kind_name, top=DEFAULT_TOP):
+    """The `top` most favorited items of a kind, ties broken by newest id."""
+    model = KINDS[kind_name].model
+    rows = db.session.execute(
+        select(model.id, model.name, model.favorite_count)
+        .where(model.favorite_count > 0)
+        .order_by(model.favorite_count.desc(), model.id.desc())
+        .limit(top)
+    )
+    return [{"id": row.id, "name": row.name, "favorite_count": row.favorite_count} for row in rows]
+
+
+def main():
+    from app import create_app
+    app = create_app(subsystems=())
+
+    start = time.perf_counter()
+    with app.app_context():
+        fixed = reconcile()
+    summary = ", ".join(f"{rows} {table}" for table, rows in fixed.items())
+    print(f"fixed {summary} in {time.perf_counter() - start:.2f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
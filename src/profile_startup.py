@@ -0,0 +1,87 @@
+"""
+Startup profile of the entry points.
+
+    python src/profile_startup.py
+    python src/profile_startup.py --target wsgi --top 20
+
+Each target starts in a fresh interpreter with `-X importtime`. The report
+gives the time to build the app, its peak RSS, and the packages that take
+the most import time (self time summed per top level package).
+
+- wsgi: the web process (gunicorn wsgi:application)
+- cli: the app `flask db` builds, with every subsystem
+- script: seeds, importer and benchmarks, without admin, migrations or CORS
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+SRC = os.path.dirname(os.path.abspath(__file__))
+
+TARGETS = {
+    "wsgi": "import wsgi",
+    "cli": "from app import create_app; create_app()",
+    "script": "from app import create_app; create_app(subsystems=())",
+}
+
+_PROBE = """
+import json, resource, sys, time
+start = time.perf_counter()
+{code}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}}))
+"""
+
+
+def parse_importtime(stderr):
+    """Return {top level package: self microseconds} from -X importtime output."""
+    packages = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        package = name.strip().split(".")[0]
+        packages[package] = packages.get(package, 0) + int(self_us)
+    return packages
+
+
+def profile(target, repeat=3):
+    """Run `target` `repeat` times; returns the fastest run with its import breakdown."""
+    env = dict(os.environ, REQUEST_LOG_LEVEL="ERROR")
+    best = None
+    for _ in range(repeat):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", _PROBE.format(code=TARGETS[target])],
+            cwd=SRC, env=env, capture_output=True, text=True,
+        )
+        if result.returncode:
+            sys.exit(f"{target} failed:\n{result.stderr[-2000:]}")
+        run = json.loads(result.stdout.strip().splitlines()[-1])
+        if best is None or run["seconds"] < best["seconds"]:
+            best = dict(run, packages=parse_importtime(result.stderr))
+    return best
+
+
+def report(target, run, top):
+    imports_ms = sum(run["packages"].values()) / 1000
+    print(f"{target}: {run['seconds'] * 1000:.0f} ms to build the app "
+          f"({imports_ms:.0f} ms importing, startup included), peak RSS {run['rss_kb'] / 1024:.1f} MB")
+    for package, self_us in sorted(run["packages"].items(), key=lambda item: -item[1])[:top]:
+        print(f"  {self_us / 1000:8.1f} ms  {package}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", choices=sorted(TARGETS), action="append", help="default: all of them")
+    parser.add_argument("--top", type=int, default=10, help="packages listed per target")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per target, the fastest is reported")
+    args = parser.parse_args(argv)
+
+    for target in args.target or TARGETS:
+        report(target, profile(target, args.repeat), args.top)
+
+
+if __name__ == "__main__":
+    main()
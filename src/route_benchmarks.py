@@ -0,0 +1,284 @@
+"""
+Per-route benchmark suite, driven by `benchmarks.py routes`.
+
+Every endpoint of app.py is exercised against a synthetic dataset (see
+synthetic.SCALES), once through the Flask test client and once through a
+real gunicorn process over HTTP. Each scenario reports throughput,
+latency percentiles, SQL statements per request and peak RSS; over HTTP
+the SQL count is read from the Server-Timing header (see
+instrumentation.py). Results are written to bench-results/<commit>.json
+so runs can be compared across commits with `benchmarks.py compare`.
+"""
+import asyncio
+import json
+import os
+import platform
+import re
+import subprocess
+import time
+from collections import Counter, namedtuple
+
+# `n` is the request number; `users` / `spare` / `items` come from the dataset
+Scenario = namedtuple("Scenario", "name method path body share", defaults=(None, 1.0))
+
+WRITER = "user_{writer}"
+
+SCENARIOS = [
+    Scenario("GET /user", "GET", "/user?limit=100&after={user_offset}"),
+    Scenario("GET /user/<id>", "GET", "/user/{user_id}"),
+    Scenario("GET /user/favorites", "GET", "/user/favorites"),
+    Scenario("GET /people", "GET", "/people?limit=100&after={item_offset}"),
+    Scenario("GET /people?fields", "GET", "/people?limit=100&fields=name,gender&after={item_offset}"),
+    Scenario("GET /people/<id>", "GET", "/people/{item_id}"),
+    Scenario("GET /planets", "GET", "/planets?limit=100&after={item_offset}"),
+    Scenario("GET /planets/<id>", "GET", "/planets/{item_id}"),
+    Scenario("GET /planets/<id>/residents", "GET", "/planets/{item_id}/residents?limit=100"),
+    Scenario("GET /starships", "GET", "/starships?limit=100&after={item_offset}"),
+    Scenario("GET /starships/<id>", "GET", "/starships/{item_id}"),
+    # Filtered and sorted pages, the sorted ones continued from a "value,id" cursor
+    Scenario("GET /people?filter", "GET", "/people?filter=height%3E170&limit=100&after={item_offset}"),
+    Scenario("GET /planets?sort", "GET", "/planets?sort=-population&limit=100"),
+    Scenario("GET /planets?sort&after", "GET", "/planets?sort=-population&limit=100&after={sort_cursor}"),
+    Scenario("GET /search", "GET", "/search?q={search_term}&limit=20"),
+    Scenario("GET /people?stream=1", "GET", "/people?stream=1", share=0.01),
+    Scenario("GET /leaderboard", "GET", "/leaderboard?kind={kind}&top=10"),
+    # Writes use users without favorites, and every removal undoes an add
+    Scenario("POST /favorite/<kind>/<id>", "POST", "/favorite/{kind}/{write_item}", {"username": WRITER}),
+    Scenario("DELETE /favorite/<kind>/<id>", "DELETE", "/favorite/{kind}/{write_item}?username=" + WRITER),
+    Scenario("POST /favorites/bulk", "POST", "/favorites/bulk", {"username": WRITER, "items": "{bulk_items}"}, 0.1),
+    Scenario("DELETE /favorites/bulk", "DELETE", "/favorites/bulk", {"username": WRITER, "items": "{bulk_items}"}, 0.1),
+]
+
+KINDS = ("planet", "people", "starship")
+BULK_SIZE = 50
+SERVER_TIMING_QUERIES = re.compile(rb'db;[^,]*desc="(\d+) quer')
+
+
+def _values(n, dataset):
+    items, users, spare = dataset["items"], dataset["users"], dataset["spare_users"]
+    writer, round_ = n % spare, n // spare
+    # synthetic.make_planet: planet <id> has a population of (id - 1) * 1000
+    sort_id = items - n * 101 % items
+    return {
+        "user_offset": n * 37 % users, "user_id": n * 37 % users + 1,
+        "item_offset": n * 101 % items, "item_id": n * 101 % items + 1,
+        "sort_cursor": f"{(sort_id - 1) * 1000},{sort_id}", "search_term": f"planet+{n * 101 % items}",
+        "writer": users + writer, "kind": KINDS[round_ % 3], "write_item": round_ // 3 % items + 1,
+        "bulk_items": [{"kind": KINDS[i % 3], "id": (round_ * BULK_SIZE + i) % items + 1} for i in range(BULK_SIZE)],
+    }
+
+
+def build_request(scenario, n, dataset):
+    """Return (method, path, headers, json body) for request `n` of a scenario."""
+    values = _values(n, dataset)
+    path = scenario.path.format(**values)
+    body = None
+    if scenario.body is not None:
+        body = {
+            key: values["bulk_items"] if value == "{bulk_items}" else value.format(**values)
+            for key, value in scenario.body.items()
+        }
+    headers = {"X-Username": f"user_{values['user_offset']}"}
+    return scenario.method, path, headers, body
+
+
+def request_count(scenario, requests):
+    return max(1, int(requests * scenario.share))
+
+
+def summarize(latencies, elapsed, statuses, queries=None, peak_rss=None):
+    latencies = sorted(latencies)
+
+    def percentile(pct):
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * pct / 100))] * 1000, 3)
+
+    return {
+        "requests": len(latencies),
+        "requests_per_sec": round(len(latencies) / elapsed, 1),
+        "p50_ms": percentile(50), "p90_ms": percentile(90), "p99_ms": percentile(99),
+        "max_ms": round(latencies[-1] * 1000, 3),
+        "queries_per_request": round(queries / len(latencies), 2) if queries is not None else None,
+        "peak_rss_mb": round(peak_rss / 1024, 1) if peak_rss is not None else None,
+        "statuses": dict(sorted(Counter(statuses).items())),
+    }
+
+
+# PEAK RSS
+def reset_peak_rss(pid="self"):
+    # Linux resets VmHWM to the current RSS when "5" is written to clear_refs
+    try:
+        with open(f"/proc/{pid}/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss_kb(pid="self"):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    if pid == "self":
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return None
+
+
+def child_pids(pid):
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(child) for child in f.read().split()]
+    except OSError:
+        return []
+
+
+# TEST CLIENT
+def run_test_client(app, dataset, requests):
+    from instrumentation import count_queries
+
+    client = app.test_client()
+    results = {}
+    for scenario in SCENARIOS:
+        count = request_count(scenario, requests)
+        latencies, statuses, queries = [], [], 0
+        reset_peak_rss()
+        start = time.perf_counter()
+        for n in range(count):
+            method, path, headers, body = build_request(scenario, n, dataset)
+            began = time.perf_counter()
+            with count_queries() as counter:
+                response = client.open(path, method=method, headers=headers, json=body)
+                response.get_data()
+            latencies.append(time.perf_counter() - began)
+            statuses.append(response.status_code)
+            queries += counter.count
+        results[scenario.name] = summarize(latencies, time.perf_counter() - start, statuses, queries, peak_rss_kb())
+    return results
+
+
+# HTTP
+async def _http_worker(port, scenario, dataset, numbers, latencies, statuses, queries):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        for n in numbers:
+            method, path, headers, body = build_request(scenario, n, dataset)
+            payload = json.dumps(body).encode() if body is not None else b""
+            lines = [f"{method} {path} HTTP/1.1", "Host: localhost", f"Content-Length: {len(payload)}"]
+            lines += [f"{name}: {value}" for name, value in headers.items()]
+            if body is not None:
+                lines.append("Content-Type: application/json")
+            began = time.perf_counter()
+            writer.write(("\r\n".join(lines) + "\r\n\r\n").encode() + payload)
+            status = int((await reader.readline()).split()[1])
+            length, chunked, close = 0, False, False
+            while (line := await reader.readline()) not in (b"\r\n", b""):
+                name, _, value = line.partition(b":")
+                name, value = name.strip().lower(), value.strip().lower()
+                if name == b"content-length":
+                    length = int(value)
+                elif name == b"transfer-encoding":
+                    chunked = value == b"chunked"
+                elif name == b"connection":
+                    close = value == b"close"
+                elif name == b"server-timing" and (match := SERVER_TIMING_QUERIES.search(value)):
+                    queries.append(int(match.group(1)))
+            if chunked:
+                while size := int((await reader.readline()).strip(), 16):
+                    await reader.readexactly(size + 2)
+                await reader.readline()
+            else:
+                await reader.readexactly(length)
+            latencies.append(time.perf_counter() - began)
+            statuses.append(status)
+            if close:
+                writer.close()
+                reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    finally:
+        writer.close()
+
+
+async def _drive_http(port, scenario, dataset, count, concurrency):
+    latencies, statuses, queries = [], [], []
+    # Each connection takes every concurrency-th request so writes never race on the same row
+    await asyncio.gather(*(
+        _http_worker(port, scenario, dataset, range(i, count, concurrency), latencies, statuses, queries)
+        for i in range(min(concurrency, count))
+    ))
+    return latencies, statuses, queries
+
+
+def wait_for_port(port, process, timeout=30):
+    import socket
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited with code {process.returncode}")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"server did not listen on port {port}")
+
+
+def run_gunicorn(dataset, requests, concurrency, workers, port):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    command = [
+        "gunicorn", "wsgi:application", "--chdir", "src", "--bind", f"127.0.0.1:{port}",
+        "--workers", str(workers), "--threads", "4", "--log-level", "warning",
+    ]
+    process = subprocess.Popen(command, cwd=root, env=os.environ.copy())
+    results = {}
+    try:
+        wait_for_port(port, process)
+        for scenario in SCENARIOS:
+            count = request_count(scenario, requests)
+            pids = [process.pid] + child_pids(process.pid)
+            for pid in pids:
+                reset_peak_rss(pid)
+            start = time.perf_counter()
+            latencies, statuses, queries = asyncio.run(_drive_http(port, scenario, dataset, count, concurrency))
+            elapsed = time.perf_counter() - start
+            peaks = [peak_rss_kb(pid) for pid in pids]
+            queries = sum(queries) if len(queries) == len(latencies) else None
+            results[scenario.name] = summarize(latencies, elapsed, statuses, queries, sum(p for p in peaks if p))
+    finally:
+        process.terminate()
+        process.wait()
+    return results
+
+
+# RESULTS
+def run_metadata(database_url, scale, dataset):
+    def git(*args):
+        try:
+            return subprocess.run(["git", *args], capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    from serialization import orjson
+    return {
+        "commit": git("rev-parse", "--short", "HEAD"),
+        "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "database": database_url.split("://", 1)[0],
+        "encoder": "orjson" if orjson else "json",
+        "scale": scale,
+        "dataset": dataset,
+    }
+
+
+def save_results(results, directory):
+    os.makedirs(directory, exist_ok=True)
+    meta = results["meta"]
+    name = f"{meta['commit'] or 'unknown'}{'-dirty' if meta['dirty'] else ''}.json"
+    path = os.path.join(directory, name)
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+        f.write("\n")
+    return path
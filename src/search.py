@@ -0,0 +1,258 @@
+"""
+Typeahead search over the catalog.
+
+    GET /search?q=luke sky&limit=10
+
+Matches Person.name, Planet.name/terrain/climate and
+Starship.name/model/manufacturer. Every word of the query must match the
+start of a word in the row; names weigh more than the other fields and
+whole words more than prefixes.
+
+SEARCH_BACKEND selects where the search runs:
+
+- memory (default): an inverted index held by each process, with a
+  sorted vocabulary for prefix lookups. It is built on the first search
+  and kept current from the commits of this process (see model_events.py).
+  Commits of other workers are noticed through the table versions of the
+  cache backend (CACHE_URL=redis://...), and reload the whole table.
+- postgres: tsvector prefix queries, plus pg_trgm similarity on names to
+  forgive typos, ranked by ts_rank + similarity. Both use the GIN indexes
+  added by migration 9e2f6a1b7c38.
+"""
+import heapq
+import os
+import re
+import threading
+import time
+from bisect import bisect_left, insort
+from flask import request
+from sqlalchemy import Float, func, literal, literal_column, or_, select, union_all
+from models import db, Person, Planet, Starship
+from utils import APIException
+from cache import cache_backend
+import model_events
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+
+# Searched columns and their weight, per table
+FIELDS = {
+    Person: {"name": 2.0},
+    Planet: {"name": 2.0, "terrain": 1.0, "climate": 1.0},
+    Starship: {"name": 2.0, "model": 1.0, "manufacturer": 1.0},
+}
+TABLES = {model.__tablename__: model for model in FIELDS}
+
+VERSION_CHECK_SECONDS = 1.0
+
+_WORD = re.compile(r"[^\W_]+")
+
+
+def tokenize(text):
+    return _WORD.findall(text.lower()) if text else []
+
+
+class SearchIndex:
+    def __init__(self):
+        self.postings = {}    # token -> {(table, id): weight}
+        self.vocabulary = []  # sorted tokens, for prefix ranges
+        self.docs = {}        # (table, id) -> (name, {token: weight})
+        self.versions = {}    # table -> version of the cache backend the index reflects
+        self.pending = {}     # table -> ids committed here since the last search, None for all
+        self.epoch = None
+        self.checked_at = 0.0
+        self._lock = threading.Lock()
+
+    # Building
+    def _add(self, key, name, tokens, sort=True):
+        self.docs[key] = (name, tokens)
+        for token, weight in tokens.items():
+            docs = self.postings.get(token)
+            if docs is None:
+                docs = self.postings[token] = {}
+                if sort:
+                    insort(self.vocabulary, token)
+            docs[key] = weight
+
+    def _remove(self, key):
+        _, tokens = self.docs.pop(key, (None, {}))
+        for token in tokens:
+            docs = self.postings[token]
+            del docs[key]
+            if not docs:
+                del self.postings[token]
+                del self.vocabulary[bisect_left(self.vocabulary, token)]
+
+    def _load(self, model, ids=None):
+        table = model.__tablename__
+        fields = FIELDS[model]
+        stmt = select(model.id, *[getattr(model, field) for field in fields])
+        if ids is not None:
+            stmt = stmt.where(model.id.in_(ids))
+            for pk in ids:
+                self._remove((table, pk))
+        else:
+            for key in [key for key in self.docs if key[0] == table]:
+                self._remove(key)
+        # One sort at the end is much cheaper than an insort per new token
+        full = ids is None
+        for row in db.session.execute(stmt):
+            tokens = {}
+            for field, value in zip(fields, row[1:]):
+                for token in tokenize(value):
+                    tokens[token] = max(tokens.get(token, 0.0), fields[field])
+            self._add((table, row[0]), row[1], tokens, sort=not full)
+        if full:
+            self.vocabulary = sorted(self.postings)
+
+    def refresh(self):
+        """Bring the index up to date; called before every search."""
+        with self._lock:
+            now = time.monotonic()
+            if self.epoch is None or now - self.checked_at > VERSION_CHECK_SECONDS:
+                self.checked_at = now
+                epoch, versions = cache_backend.versions(list(TABLES))
+                for table, (version, _) in versions.items():
+                    if epoch != self.epoch or version > self.versions.get(table, -1):
+                        self.pending[table] = None  # changed by another process
+                    self.versions[table] = version
+                self.epoch = epoch
+            for table, ids in self.pending.items():
+                self._load(TABLES[table], ids)
+            self.pending = {}
+
+    def record_commit(self, changes):
+        with self._lock:
+            if self.epoch is None:
+                return  # not built yet
+            for table in TABLES.keys() & changes.keys():
+                ids = changes[table]
+                if ids is None or self.pending.get(table, set()) is None:
+                    self.pending[table] = None
+                else:
+                    self.pending.setdefault(table, set()).update(ids)
+            # Our own commit bumped each of these versions by one (see
+            # conditional.py). Only take that step: a bigger jump includes
+            # commits of other processes, which the next refresh must reload
+            _, versions = cache_backend.versions(list(TABLES.keys() & changes.keys()))
+            for table, (version, _) in versions.items():
+                if version == self.versions.get(table, -1) + 1:
+                    self.versions[table] = version
+
+    # Querying
+    def _tokens(self, word):
+        """Vocabulary tokens starting with `word`."""
+        vocabulary = self.vocabulary
+        i = bisect_left(vocabulary, word)
+        while i < len(vocabulary) and vocabulary[i].startswith(word):
+            yield vocabulary[i]
+            i += 1
+
+    def _matches(self, word, tokens):
+        """Return {doc: score} for the documents having one of `tokens`."""
+        scores = {}
+        for token in tokens:
+            factor = len(word) / len(token)
+            for key, weight in self.postings[token].items():
+                score = weight * factor
+                if score > scores.get(key, 0.0):
+                    scores[key] = score
+        return scores
+
+    def _score(self, key, word):
+        # Best prefix match of `word` among the tokens of one document, or 0
+        return max(
+            (weight * len(word) / len(token) for token, weight in self.docs[key][1].items() if token.startswith(word)),
+            default=0.0,
+        )
+
+    def search(self, query, limit=DEFAULT_LIMIT):
+        words = set(tokenize(query))
+        if not words:
+            return []
+        with self._lock:
+            # Candidates come from the rarest word. The others intersect their
+            # postings, or check the tokens of each candidate when there are
+            # far fewer candidates than postings
+            ranges = {word: list(self._tokens(word)) for word in words}
+            sizes = {word: sum(len(self.postings[token]) for token in tokens) for word, tokens in ranges.items()}
+            words = sorted(words, key=sizes.get)
+            scores = self._matches(words[0], ranges[words[0]])
+            for word in words[1:]:
+                if sizes[word] <= 4 * len(scores):
+                    matches = self._matches(word, ranges[word])
+                    scores = {key: score + matches[key] for key, score in scores.items() if key in matches}
+                    continue
+                matched = {}
+                for key, score in scores.items():
+                    extra = self._score(key, word)
+                    if extra:
+                        matched[key] = score + extra
+                scores = matched
+            docs = self.docs
+            best = heapq.nsmallest(limit, scores.items(), key=lambda item: (-item[1], len(docs[item[0]][0]), item[0]))
+            return [
+                {"kind": key[0], "id": key[1], "name": docs[key][0], "score": round(score, 3)}
+                for key, score in best
+            ]
+
+
+search_index = SearchIndex()
+
+
+@model_events.subscribe
+def _index_commit(changes):
+    search_index.record_commit(changes)
+
+
+# POSTGRES
+def document(model):
+    """The text searched in a row; the GIN indexes are built on the same expression."""
+    text = None
+    for field in FIELDS[model]:
+        # Inline literals so the expression matches the index definition
+        value = func.coalesce(getattr(model, field), literal_column("''"))
+        text = value if text is None else text.op("||")(literal_column("' '")).op("||")(value)
+    return func.to_tsvector(literal_column("'simple'::regconfig"), text)
+
+
+def _tsquery(query):
+    # Every word as a prefix: "sky wal" -> "sky:* & wal:*"
+    return " & ".join(f"{word}:*" for word in tokenize(query))
+
+
+def postgres_search(query, limit=DEFAULT_LIMIT):
+    tsquery = func.to_tsquery(literal_column("'simple'::regconfig"), _tsquery(query))
+    selects = []
+    for model in FIELDS:
+        vector = document(model)
+        score = func.ts_rank(vector, tsquery) + func.similarity(model.name, query)
+        selects.append(
+            select(literal(model.__tablename__).label("kind"), model.id, model.name, score.cast(Float).label("score"))
+            .where(or_(vector.op("@@")(tsquery), model.name.op("%")(query)))
+        )
+    rows = db.session.execute(
+        select(union_all(*selects).subquery()).order_by(literal_column("score").desc()).limit(limit)
+    )
+    return [{"kind": row.kind, "id": row.id, "name": row.name, "score": round(row.score, 3)} for row in rows]
+
+
+def parse_search_args():
+    query = request.args.get("q", "")
+    if not tokenize(query):
+        raise APIException("'q' must contain at least one letter or digit", status_code=400)
+    try:
+        limit = int(request.args.get("limit") or DEFAULT_LIMIT)
+    except ValueError:
+        raise APIException("'limit' must be an integer", status_code=400)
+    if limit < 1 or limit > MAX_LIMIT:
+        raise APIException(f"'limit' must be between 1 and {MAX_LIMIT}", status_code=400)
+    return query, limit
+
+
+def search(query, limit=DEFAULT_LIMIT):
+    """Search the catalog with the backend picked by SEARCH_BACKEND."""
+    if os.environ.get("SEARCH_BACKEND", "memory") == "postgres":
+        return postgres_search(query, limit)
+    search_index.refresh()
+    return search_index.search(query, limit)
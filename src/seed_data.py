@@ -1,21 +1,15 @@
-from models import db, Person, Planet, Starship, Favorite
-from app import app
+from models import db, Person, Planet, Starship
+from importer import reset, load_records
+from app import create_app
 
 def seed_data():
-    with app.app_context():
-        # Delete favorites first (for persons, planets, starships)
-        db.session.query(Favorite).delete()
-        
-        # Clear existing data (optional but useful for dev)
-        db.session.query(Person).delete()
-        db.session.query(Planet).delete()
-        db.session.query(Starship).delete()
-
-        db.session.commit()
+    with create_app(subsystems=()).app_context():
+        # Clear existing data (optional but useful for dev); favorites go with it
+        reset([Person, Planet, Starship])
 
         # Add people
         people = [
-            Person(
+            dict(
                 name="Luke Skywalker",
                 birth_year="19BBY",
                 eye_color="blue",
@@ -26,7 +20,7 @@ def seed_data():
                 skin_color="fair",
                 homeworld="https://www.swapi.tech/api/planets/1"
             ),
-            Person(
+            dict(
                 name="Leia Organa",
                 birth_year="19BBY",
                 eye_color="brown",
@@ -37,7 +31,7 @@ def seed_data():
                 skin_color="light",
                 homeworld="https://www.swapi.tech/api/planets/2"
             ),
-            Person(
+            dict(
                 name="Darth Vader",
                 birth_year="41.9BBY",
                 eye_color="yellow",
@@ -52,7 +46,7 @@ def seed_data():
 
         # Add planets
         planets = [
-            Planet(
+            dict(
                 name="Tatooine",
                 climate="arid",
                 diameter=10465.0,
@@ -63,7 +57,7 @@ def seed_data():
                 surface_water=1.0,
                 terrain="desert"
             ),
-            Planet(
+            dict(
                 name="Alderaan",
                 climate="temperate",
                 diameter=12500.0,
@@ -74,7 +68,7 @@ def seed_data():
                 surface_water=40.0,
                 terrain="grasslands, mountains"
             ),
-            Planet(
+            dict(
                 name="Hoth",
                 climate="frozen",
                 diameter=7200.0,
@@ -89,7 +83,7 @@ def seed_data():
 
         # Add starships
         starships = [
-            Starship(
+            dict(
                 name="X-wing",
                 model="T-65 X-wing",
                 starship_class="Starfighter",
@@ -102,7 +96,7 @@ def seed_data():
                 cargo_capacity=110.0,
                 consumables="1 week"
             ),
-            Starship(
+            dict(
                 name="TIE Advanced x1",
                 model="Twin Ion Engine Advanced x1",
                 starship_class="Starfighter",
@@ -115,7 +109,7 @@ def seed_data():
                 cargo_capacity=150.0,
                 consumables="5 days"
             ),
-            Starship(
+            dict(
                 name="Millennium Falcon",
                 model="YT-1300 light freighter",
                 starship_class="Light freighter",
@@ -130,7 +124,9 @@ def seed_data():
             ),
         ]
 
-        db.session.add_all(planets + people + starships)
+        load_records(Planet, planets)
+        load_records(Person, people)
+        load_records(Starship, starships)
         db.session.commit()
         print("Seed data added successfully!")
 
@@ -1,45 +1,45 @@
 import random
-from app import app
+from sqlalchemy import select
+from app import create_app
 from models import db, User, Favorite, Planet, Person, Starship
+from importer import reset, load_records
+from popularity import reconcile
 
 def seed_users_and_favorites():
-    with app.app_context():
+    with create_app(subsystems=()).app_context():
         # Optional: Clear existing users and favorites
-        db.session.query(Favorite).delete()
-        db.session.query(User).delete()
+        reset([User])
 
         # Create users
         users = [
-            User(username="luke_skywalker"),
-            User(username="leia_organa"),
-            User(username="vader")
+            dict(username="luke_skywalker"),
+            dict(username="leia_organa"),
+            dict(username="vader")
+        ]
+        load_records(User, users)
+        user_ids = db.session.scalars(select(User.id).order_by(User.id)).all()
+
+        # Retrieve seeded content, as (favorite column, id) pairs
+        all_items = [
+            (column, item_id)
+            for model, column in ((Planet, "planet_id"), (Person, "person_id"), (Starship, "starship_id"))
+            for item_id in db.session.scalars(select(model.id))
         ]
-        db.session.add_all(users)
-        db.session.commit()
-
-        # Retrieve seeded content
-        planets = Planet.query.all()
-        people = Person.query.all()
-        starships = Starship.query.all()
-
-        all_items = planets + people + starships
 
-        def create_favorite(user, item):
-            if isinstance(item, Planet):
-                return Favorite(user_id=user.id, planet_id=item.id)
-            elif isinstance(item, Person):
-                return Favorite(user_id=user.id, person_id=item.id)
-            elif isinstance(item, Starship):
-                return Favorite(user_id=user.id, starship_id=item.id)
-            return None
+        def create_favorite(user_id, item):
+            column, item_id = item
+            return {"user_id": user_id, "person_id": None, "planet_id": None, "starship_id": None, column: item_id}
 
         # Assign 2–3 random favorites per user
-        for user in users:
+        favorites = []
+        for user_id in user_ids:
             chosen_items = random.sample(all_items, k=random.randint(2, 3))
-            favorites = [create_favorite(user, item) for item in chosen_items]
-            db.session.add_all(favorites)
+            favorites += [create_favorite(user_id, item) for item in chosen_items]
+        load_records(Favorite, favorites)
 
         db.session.commit()
+        # The favorites skipped the endpoints, count them in one pass
+        reconcile()
         print("🌱 Seed users and random favorites added successfully!")
 
 if __name__ == "__main__":
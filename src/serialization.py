@@ -0,0 +1,75 @@
+"""
+Serialization helpers shared by the endpoints.
+
+- ModelSerializer compiles the column list of a model once and turns ORM
+  objects or plain `Row` tuples into dicts, so list endpoints can select
+  columns directly instead of hydrating ORM instances. Deferred columns
+  (bookkeeping such as favorite_count) are not part of the output.
+- FastJSONProvider encodes with orjson when it is installed and falls back
+  to the standard library encoder otherwise.
+"""
+import json
+from functools import lru_cache
+from operator import attrgetter
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import inspect, select
+from instrumentation import timing
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class ModelSerializer:
+    def __init__(self, model, fields=None):
+        self.model = model
+        self.keys = tuple(fields or [attr.key for attr in inspect(model).column_attrs if not attr.deferred])
+        self.attributes = [getattr(model, key) for key in self.keys]
+        self._getter = attrgetter(*self.keys)
+
+    def select(self):
+        return select(*self.attributes)
+
+    def from_object(self, obj):
+        values = self._getter(obj)
+        if len(self.keys) == 1:
+            values = (values,)
+        return dict(zip(self.keys, values))
+
+    def from_row(self, row):
+        return dict(zip(self.keys, row))
+
+
+@lru_cache(maxsize=256)
+def _cached_serializer(model, fields):
+    return ModelSerializer(model, fields)
+
+
+def serializer_for(model, fields=None):
+    return _cached_serializer(model, tuple(fields) if fields else None)
+
+
+def dumps_bytes(obj, sort_keys=True, default=None):
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_SORT_KEYS if sort_keys else 0)
+        return orjson.dumps(obj, default=default, option=option)
+    return json.dumps(obj, default=default, sort_keys=sort_keys, separators=(",", ":")).encode()
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    def _use_orjson(self, kwargs):
+        return orjson is not None and set(kwargs) <= {"separators"}
+
+    def dumps(self, obj, **kwargs):
+        if not self._use_orjson(kwargs):
+            return super().dumps(obj, **kwargs)
+        return dumps_bytes(obj, self.sort_keys, self.default).decode()
+
+    def response(self, *args, **kwargs):
+        with timing("encode"):
+            if orjson is None or (self.compact is None and self._app.debug) or self.compact is False:
+                return super().response(*args, **kwargs)
+            obj = self._prepare_response_obj(args, kwargs)
+            body = dumps_bytes(obj, self.sort_keys, self.default) + b"\n"
+        return self._app.response_class(body, mimetype=self.mimetype)
@@ -0,0 +1,56 @@
+"""
+Streaming exports of a whole catalog table.
+
+    GET /people?stream=1                          -> chunked JSON array
+    GET /people  (Accept: application/x-ndjson)   -> one JSON object per line
+
+Rows are read as plain column tuples in batches through a server-side
+cursor (`yield_per`) and written out batch by batch, so memory use does
+not grow with the table.
+"""
+from flask import Response, current_app, request, stream_with_context
+from models import db
+from serialization import serializer_for
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+STREAM_BATCH_SIZE = 500
+
+
+def wants_ndjson():
+    best = request.accept_mimetypes.best_match(["application/json", NDJSON_MIMETYPE])
+    return best == NDJSON_MIMETYPE
+
+
+def wants_stream():
+    return wants_ndjson() or request.args.get("stream", "").lower() in ("1", "true", "yes")
+
+
+def iter_batches(model):
+    serializer = serializer_for(model)
+    stmt = serializer.select().order_by(model.id).execution_options(yield_per=STREAM_BATCH_SIZE)
+    for batch in db.session.execute(stmt).partitions():
+        yield [serializer.from_row(row) for row in batch]
+
+
+def _ndjson_chunks(model):
+    dumps = current_app.json.dumps
+    for batch in iter_batches(model):
+        yield "".join(dumps(item) + "\n" for item in batch)
+
+
+def _json_array_chunks(model):
+    dumps = current_app.json.dumps
+    yield "["
+    separator = ""
+    for batch in iter_batches(model):
+        yield separator + ",".join(dumps(item) for item in batch)
+        separator = ","
+    yield "]\n"
+
+
+def stream_export(model):
+    if wants_ndjson():
+        chunks, mimetype = _ndjson_chunks(model), NDJSON_MIMETYPE
+    else:
+        chunks, mimetype = _json_array_chunks(model), "application/json"
+    return Response(stream_with_context(chunks), mimetype=mimetype)
@@ -0,0 +1,96 @@
+"""
+Loads an offline SWAPI snapshot (swapi.dev or swapi.tech JSON) into the
+catalog tables, keeping the SWAPI ids.
+
+    python src/swapi.py path/to/dump --truncate
+
+The dump is a directory holding people*.json, planets*.json and
+starships*.json (one file or one per page, as saved from the API), or a
+single JSON file shaped like {"people": [...], "planets": [...],
+"starships": [...]}. Each homeworld URL is resolved into Person.planet_id.
+Unknown numbers are stored as 0, like in seed_data.py.
+"""
+import argparse
+import glob
+import json
+import os
+import re
+import sys
+import time
+from sqlalchemy import Float, select
+from models import db, Person, Planet, Starship
+from importer import read_records, reset, load_records, NULLS
+from utils import planet_id_from_url
+
+# Planets first, people point at them
+KINDS = {"planets": Planet, "people": Person, "starships": Starship}
+
+_ID_URL = re.compile(r"/(\d+)/?$")
+
+
+def snapshot_files(path):
+    """Return {kind: [records]} read from a dump directory or file."""
+    if os.path.isdir(path):
+        return {
+            kind: [record for name in sorted(glob.glob(os.path.join(path, f"{kind}*.json"))) for record in read_records(name)]
+            for kind in KINDS
+        }
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    return {kind: [record.get("properties", record) for record in data.get(kind, [])] for kind in KINDS}
+
+
+def prepare(kind, records, planet_ids=None):
+    """Yield records with their SWAPI id, numbers filled in and planet_id resolved."""
+    model = KINDS[kind]
+    floats = [column.key for column in model.__table__.columns if isinstance(column.type, Float)]
+    for record in records:
+        record = dict(record)
+        match = _ID_URL.search(record.get("url") or "")
+        if match:
+            record["id"] = int(match.group(1))
+        for key in floats:
+            value = record.get(key)
+            if value is None or (isinstance(value, str) and value.strip().lower() in NULLS):
+                record[key] = 0.0
+        if model is Person:
+            planet_id = planet_id_from_url(record.get("homeworld"))
+            record["planet_id"] = planet_id if planet_ids is None or planet_id in planet_ids else None
+        yield record
+
+
+def load_snapshot(path, truncate=False):
+    """Load a dump in one transaction; returns {table: rows}."""
+    snapshot = snapshot_files(path)
+    if truncate:
+        reset(KINDS.values())
+    counts = {}
+    for kind, model in KINDS.items():
+        planet_ids = set(db.session.scalars(select(Planet.id))) if model is Person else None
+        counts[model.__tablename__] = load_records(model, prepare(kind, snapshot[kind], planet_ids), f"{path} ({kind})")
+    db.session.commit()
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="dump directory or JSON file")
+    parser.add_argument("--truncate", action="store_true", help="empty the catalog (and favorites) first")
+    args = parser.parse_args(argv)
+
+    from app import create_app
+    app = create_app(subsystems=())
+
+    start = time.perf_counter()
+    with app.app_context():
+        try:
+            counts = load_snapshot(args.path, args.truncate)
+        except ValueError as error:
+            db.session.rollback()
+            sys.exit(str(error))
+    summary = ", ".join(f"{rows} {table}" for table, rows in counts.items())
+    print(f"loaded {summary} in {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Synthetic data generator used by the benchmarks and query plan checks.
+Rows are inserted in batches with Core executemany, not one ORM object
+at a time.
+"""
+from sqlalchemy import insert
+from models import db, User, Person, Planet, Starship, Favorite
+from popularity import reconcile
+
+BATCH_SIZE = 10000
+
+
+def make_person(i, planets=60):
+    return {
+        "name": f"Person {i}", "birth_year": f"{i % 100}BBY", "eye_color": "blue",
+        "gender": "male" if i % 2 else "female", "hair_color": "brown",
+        "height": 150.0 + i % 60, "mass": 50.0 + i % 80, "skin_color": "fair",
+        "homeworld": f"https://www.swapi.tech/api/planets/{i % planets + 1}", "planet_id": i % planets + 1,
+    }
+
+
+def make_planet(i):
+    return {
+        "name": f"Planet {i}", "climate": "temperate", "diameter": 5000.0 + i,
+        "gravity": "1 standard", "orbital_period": 300.0 + i % 200,
+        "population": float(i * 1000), "rotation_period": 24.0,
+        "surface_water": float(i % 100), "terrain": "grasslands, mountains",
+    }
+
+
+def make_starship(i):
+    return {
+        "name": f"Starship {i}", "model": f"Model {i % 50}", "starship_class": "Starfighter",
+        "manufacturer": "Incom Corporation", "cost_in_credits": 100000.0 + i,
+        "length": 10.0 + i % 300, "crew": "1", "passengers": "0",
+        "max_atmosphering_speed": "1050", "cargo_capacity": 100.0 + i, "consumables": "1 week",
+    }
+
+
+def make_user(i):
+    return {"username": f"user_{i}", "is_active": True}
+
+
+def _insert_batches(model, factory, count):
+    for start in range(0, count, BATCH_SIZE):
+        rows = [factory(i) for i in range(start, min(start + BATCH_SIZE, count))]
+        db.session.execute(insert(model), rows)
+
+
+def _favorite_rows(users, items, per_user):
+    # Deterministic spread of favorites; (user, kind, item) never repeats
+    columns = ("person_id", "planet_id", "starship_id")
+    for user_id in range(1, users + 1):
+        for j in range(per_user):
+            row = {"user_id": user_id, "person_id": None, "planet_id": None, "starship_id": None}
+            row[columns[j % 3]] = (user_id * 7 + (j // 3) * 13) % items + 1
+            yield row
+
+
+# Dataset sizes used by the benchmarks; "large" is ~100x the SWAPI seed with 1M favorites
+SCALES = {
+    "small": {"people": 1000, "planets": 1000, "starships": 1000, "users": 1000, "favorites_per_user": 10},
+    "large": {"people": 100000, "planets": 100000, "starships": 100000, "users": 100000, "favorites_per_user": 10},
+}
+
+
+def populate(people=1000, planets=1000, starships=1000, users=1000, favorites_per_user=3, spare_users=0):
+    """Insert synthetic rows into empty tables; ids start at 1.
+
+    `spare_users` more users (user_<users> onwards) are created without favorites.
+    """
+    _insert_batches(Planet, make_planet, planets)
+    _insert_batches(Person, lambda i: make_person(i, planets), people)
+    _insert_batches(Starship, make_starship, starships)
+    _insert_batches(User, make_user, users + spare_users)
+
+    items = min(people, planets, starships)
+    batch = []
+    for row in _favorite_rows(users, items, favorites_per_user):
+        batch.append(row)
+        if len(batch) == BATCH_SIZE:
+            db.session.execute(insert(Favorite), batch)
+            batch = []
+    if batch:
+        db.session.execute(insert(Favorite), batch)
+    db.session.commit()
+    reconcile()
@@ -1,3 +1,4 @@
+import re
 from flask import url_for
 
 class APIException(Exception):
@@ -15,13 +16,20 @@ class APIException(Exception):
         rv['message'] = self.message
         return rv
 
+_PLANET_URL = re.compile(r"/planets/(\d+)/?$")
+
+def planet_id_from_url(url):
+    """Return N for a SWAPI planet URL (.../api/planets/N), or None."""
+    match = _PLANET_URL.search(url or "")
+    return int(match.group(1)) if match else None
+
 def has_no_empty_params(rule):
     defaults = rule.defaults if rule.defaults is not None else ()
     arguments = rule.arguments if rule.arguments is not None else ()
     return len(defaults) >= len(arguments)
 
 def generate_sitemap(app):
-    links = ['/admin/']
+    links = ['/admin/'] if "admin" in app.blueprints else []
     for rule in app.url_map.iter_rules():
         # Filter out rules we can't navigate to in a browser
         # and rules that require parameters
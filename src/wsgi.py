@@ -1,7 +1,10 @@
 # This file was created to run the application on heroku using gunicorn.
 # Read more about it here: https://devcenter.heroku.com/articles/python-gunicorn
 
-from app import app as application
+from app import create_app
+
+# The migration commands are only needed by `flask db`, which builds its own app
+application = create_app(subsystems=("admin", "cors"))
 
 if __name__ == "__main__":
     application.run()